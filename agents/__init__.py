@@ -4,10 +4,22 @@
 基于LangGraph的智能代理系统，提供RAG检索增强和对话管理功能。
 """
 
-from .rag_agent import RAGAgent
+from typing import TYPE_CHECKING
+
 from .conversation_manager import ConversationManager
 
+if TYPE_CHECKING:
+    from .rag_agent import RAGAgent
+
 __all__ = ["RAGAgent", "ConversationManager"]
 
+
+def __getattr__(name):
+    # RAGAgent依赖numpy、langgraph等较重的模块，首次访问时再导入
+    if name == "RAGAgent":
+        from .rag_agent import RAGAgent
+        return RAGAgent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # 版本信息
 __version__ = "0.1.0" 
\ No newline at end of file
@@ -4,7 +4,13 @@
 管理多轮对话的状态、历史和上下文。
 """
 
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import islice
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Deque
 from datetime import datetime
 from loguru import logger
 
@@ -14,22 +20,66 @@ except ImportError as e:
     logger.error(f"导入langchain模块失败: {e}")
     raise
 
+
+@dataclass(slots=True)
+class SessionMeta:
+    """会话元数据"""
+    start_time: datetime
+    last_activity: datetime
+    last_activity_mono: float = field(default_factory=time.monotonic)
+    message_count: int = 0
+    user_messages: int = 0
+    ai_messages: int = 0
+
+
 class ConversationManager:
     """对话管理器，处理多轮对话和状态管理"""
     
-    def __init__(self, max_history: int = 10):
+    def __init__(self, max_history: int = 10,
+                 cleanup_interval: Optional[float] = 300,
+                 max_age_hours: float = 24):
         """
         初始化对话管理器
         
         Args:
             max_history: 最大历史记录数
+            cleanup_interval: 后台清理旧对话的间隔（秒），为None时不启动后台清理
+            max_age_hours: 后台清理时对话的最大保留时间（小时）
         """
         self.max_history = max_history
-        self.conversations: Dict[str, List[BaseMessage]] = {}
-        self.conversation_metadata: Dict[str, Dict[str, Any]] = {}
+        self._history_cap = max_history * 2  # 每轮包含用户和AI两条消息
+        self.conversations: Dict[str, Deque[BaseMessage]] = {}
+        self.conversation_metadata: Dict[str, SessionMeta] = {}
+        # 后台清理线程与请求线程并发修改会话，增删改查都在锁内进行（可重入：add_message会调用start_conversation）
+        self._lock = threading.RLock()
+        
+        # 后台定时清理旧对话，避免在用户请求路径上同步清理
+        self.cleanup_interval = cleanup_interval
+        self.max_age_hours = max_age_hours
+        self._cleanup_timer: Optional[threading.Timer] = None
+        if cleanup_interval:
+            self._schedule_cleanup()
         
         logger.info("对话管理器初始化完成")
     
+    def _schedule_cleanup(self):
+        """调度下一次后台清理"""
+        self._cleanup_timer = threading.Timer(self.cleanup_interval, self._cleanup)
+        self._cleanup_timer.daemon = True
+        self._cleanup_timer.start()
+    
+    def _cleanup(self):
+        """后台清理任务：清理旧对话后重新调度"""
+        self.cleanup_old_conversations(self.max_age_hours)
+        if self._cleanup_timer is not None:
+            self._schedule_cleanup()
+    
+    def stop(self):
+        """停止后台清理"""
+        if self._cleanup_timer is not None:
+            self._cleanup_timer.cancel()
+            self._cleanup_timer = None
+    
     def start_conversation(self, session_id: str) -> bool:
         """
         开始新对话
@@ -41,18 +91,16 @@ class ConversationManager:
             是否成功开始
         """
         try:
-            if session_id not in self.conversations:
-                self.conversations[session_id] = []
-                self.conversation_metadata[session_id] = {
-                    'start_time': datetime.now(),
-                    'message_count': 0,
-                    'last_activity': datetime.now()
-                }
-                logger.info(f"开始新对话: {session_id}")
-                return True
-            else:
-                logger.warning(f"对话已存在: {session_id}")
-                return False
+            with self._lock:
+                if session_id not in self.conversations:
+                    self.conversations[session_id] = deque(maxlen=self._history_cap)
+                    now = datetime.now()
+                    self.conversation_metadata[session_id] = SessionMeta(start_time=now, last_activity=now)
+                    logger.info(f"开始新对话: {session_id}")
+                    return True
+                else:
+                    logger.warning(f"对话已存在: {session_id}")
+                    return False
                 
         except Exception as e:
             logger.error(f"开始对话失败: {e}")
@@ -72,33 +120,29 @@ class ConversationManager:
         Returns:
             是否添加成功
         """
-        try:
+        # 创建消息对象
+        msg = HumanMessage(content=message) if is_user else AIMessage(content=message)
+        
+        with self._lock:
             if session_id not in self.conversations:
                 self.start_conversation(session_id)
             
-            # 创建消息对象
+            metadata = self.conversation_metadata[session_id]
             if is_user:
-                msg = HumanMessage(content=message)
+                metadata.user_messages += 1
             else:
-                msg = AIMessage(content=message)
+                metadata.ai_messages += 1
             
-            # 添加到历史
+            # 添加到历史（deque达到maxlen后自动淘汰最早的消息）
             self.conversations[session_id].append(msg)
             
             # 更新元数据
-            self.conversation_metadata[session_id]['message_count'] += 1
-            self.conversation_metadata[session_id]['last_activity'] = datetime.now()
-            
-            # 限制历史长度
-            if len(self.conversations[session_id]) > self.max_history * 2:
-                self.conversations[session_id] = self.conversations[session_id][-self.max_history * 2:]
-            
-            logger.debug(f"添加消息到对话 {session_id}: {'用户' if is_user else 'AI'}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"添加消息失败: {e}")
-            return False
+            metadata.message_count += 1
+            metadata.last_activity = datetime.now()
+            metadata.last_activity_mono = time.monotonic()
+        
+        logger.debug("添加消息到对话 {}: {}", session_id, "用户" if is_user else "AI")
+        return True
     
     def get_conversation_history(self, session_id: str, 
                                 limit: Optional[int] = None) -> List[BaseMessage]:
@@ -112,20 +156,15 @@ class ConversationManager:
         Returns:
             对话历史列表
         """
-        try:
-            if session_id not in self.conversations:
+        with self._lock:
+            history = self.conversations.get(session_id)
+            if history is None:
                 return []
             
-            history = self.conversations[session_id]
-            
             if limit:
-                history = history[-limit:]
-            
-            return history
+                return list(islice(history, max(0, len(history) - limit), len(history)))
             
-        except Exception as e:
-            logger.error(f"获取对话历史失败: {e}")
-            return []
+            return list(history)
     
     def get_conversation_summary(self, session_id: str) -> Dict[str, Any]:
         """
@@ -137,30 +176,24 @@ class ConversationManager:
         Returns:
             对话摘要
         """
-        try:
-            if session_id not in self.conversations:
+        with self._lock:
+            metadata = self.conversation_metadata.get(session_id)
+            if metadata is None:
                 return {}
-            
-            metadata = self.conversation_metadata[session_id]
-            history = self.conversations[session_id]
-            
-            # 统计消息类型
-            user_messages = sum(1 for msg in history if isinstance(msg, HumanMessage))
-            ai_messages = sum(1 for msg in history if isinstance(msg, AIMessage))
-            
-            return {
-                'session_id': session_id,
-                'start_time': metadata['start_time'],
-                'last_activity': metadata['last_activity'],
-                'total_messages': metadata['message_count'],
-                'user_messages': user_messages,
-                'ai_messages': ai_messages,
-                'duration': (metadata['last_activity'] - metadata['start_time']).total_seconds()
-            }
-            
-        except Exception as e:
-            logger.error(f"获取对话摘要失败: {e}")
-            return {}
+            return self._build_summary(session_id, metadata)
+    
+    @staticmethod
+    def _build_summary(session_id: str, metadata: SessionMeta) -> Dict[str, Any]:
+        """根据会话元数据构建摘要（不访问对话历史）"""
+        return {
+            'session_id': session_id,
+            'start_time': metadata.start_time,
+            'last_activity': metadata.last_activity,
+            'total_messages': metadata.message_count,
+            'user_messages': metadata.user_messages,
+            'ai_messages': metadata.ai_messages,
+            'duration': (metadata.last_activity - metadata.start_time).total_seconds()
+        }
     
     def clear_conversation(self, session_id: str) -> bool:
         """
@@ -173,18 +206,16 @@ class ConversationManager:
             是否清空成功
         """
         try:
-            if session_id in self.conversations:
-                self.conversations[session_id] = []
-                self.conversation_metadata[session_id] = {
-                    'start_time': datetime.now(),
-                    'message_count': 0,
-                    'last_activity': datetime.now()
-                }
-                logger.info(f"清空对话历史: {session_id}")
-                return True
-            else:
-                logger.warning(f"对话不存在: {session_id}")
-                return False
+            with self._lock:
+                if session_id in self.conversations:
+                    self.conversations[session_id] = deque(maxlen=self._history_cap)
+                    now = datetime.now()
+                    self.conversation_metadata[session_id] = SessionMeta(start_time=now, last_activity=now)
+                    logger.info(f"清空对话历史: {session_id}")
+                    return True
+                else:
+                    logger.warning(f"对话不存在: {session_id}")
+                    return False
                 
         except Exception as e:
             logger.error(f"清空对话失败: {e}")
@@ -201,14 +232,15 @@ class ConversationManager:
             是否删除成功
         """
         try:
-            if session_id in self.conversations:
-                del self.conversations[session_id]
-                del self.conversation_metadata[session_id]
-                logger.info(f"删除对话: {session_id}")
-                return True
-            else:
-                logger.warning(f"对话不存在: {session_id}")
-                return False
+            with self._lock:
+                if session_id in self.conversations:
+                    del self.conversations[session_id]
+                    del self.conversation_metadata[session_id]
+                    logger.info(f"删除对话: {session_id}")
+                    return True
+                else:
+                    logger.warning(f"对话不存在: {session_id}")
+                    return False
                 
         except Exception as e:
             logger.error(f"删除对话失败: {e}")
@@ -222,14 +254,14 @@ class ConversationManager:
             所有对话摘要列表
         """
         try:
-            summaries = []
-            for session_id in self.conversations.keys():
-                summary = self.get_conversation_summary(session_id)
-                if summary:
-                    summaries.append(summary)
+            with self._lock:
+                summaries = [
+                    self._build_summary(session_id, metadata)
+                    for session_id, metadata in self.conversation_metadata.items()
+                ]
             
             # 按最后活动时间排序
-            summaries.sort(key=lambda x: x['last_activity'], reverse=True)
+            summaries.sort(key=itemgetter('last_activity'), reverse=True)
             
             return summaries
             
@@ -237,7 +269,7 @@ class ConversationManager:
             logger.error(f"获取所有对话失败: {e}")
             return []
     
-    def cleanup_old_conversations(self, max_age_hours: int = 24) -> int:
+    def cleanup_old_conversations(self, max_age_hours: float = 24) -> int:
         """
         清理旧对话
         
@@ -248,17 +280,19 @@ class ConversationManager:
             清理的对话数量
         """
         try:
-            current_time = datetime.now()
-            sessions_to_delete = []
-            
-            for session_id, metadata in self.conversation_metadata.items():
-                age_hours = (current_time - metadata['last_activity']).total_seconds() / 3600
-                if age_hours > max_age_hours:
-                    sessions_to_delete.append(session_id)
-            
-            # 删除旧对话
-            for session_id in sessions_to_delete:
-                self.delete_conversation(session_id)
+            # 使用单调时钟判断过期，避免系统时间调整的影响；
+            # 判断与删除在同一把锁内完成，不会删掉判断之后刚有新消息的会话
+            cutoff = time.monotonic() - max_age_hours * 3600
+            with self._lock:
+                sessions_to_delete = [
+                    session_id
+                    for session_id, metadata in self.conversation_metadata.items()
+                    if metadata.last_activity_mono < cutoff
+                ]
+                
+                # 删除旧对话
+                for session_id in sessions_to_delete:
+                    self.delete_conversation(session_id)
             
             logger.info(f"清理了 {len(sessions_to_delete)} 个旧对话")
             return len(sessions_to_delete)
@@ -274,19 +308,15 @@ class ConversationManager:
         Returns:
             统计信息
         """
-        try:
+        with self._lock:
             total_conversations = len(self.conversations)
             total_messages = sum(
-                metadata['message_count'] 
+                metadata.message_count 
                 for metadata in self.conversation_metadata.values()
             )
-            
-            return {
-                'total_conversations': total_conversations,
-                'total_messages': total_messages,
-                'max_history': self.max_history
-            }
-            
-        except Exception as e:
-            logger.error(f"获取统计信息失败: {e}")
-            return {} 
\ No newline at end of file
+        
+        return {
+            'total_conversations': total_conversations,
+            'total_messages': total_messages,
+            'max_history': self.max_history
+        } 
\ No newline at end of file
@@ -4,23 +4,46 @@ RAG代理
 基于LangGraph的检索增强生成代理，结合知识库和LLM提供智能回答。
 """
 
-from typing import TypedDict, List, Dict, Any, Optional
+import io
+import threading
+from typing import TYPE_CHECKING, TypedDict, List, Dict, Any, Optional, Iterator
 import numpy as np
 from loguru import logger
 
 try:
     from langgraph.graph import StateGraph, END
-    from langgraph.prebuilt import ToolNode
-    from langchain.schema import Document
-    from langchain_core.messages import HumanMessage, AIMessage
+    from langchain_core.messages import HumanMessage, AIMessageChunk
 except ImportError as e:
     logger.error(f"导入langgraph模块失败: {e}")
     raise
 
-from core.vector_store import ChromaVectorStore
-from core.retriever import HybridRetriever
-from core.llm_manager import LLMManager
-from knowledge.vectorizer import Vectorizer
+# 向量库、检索器、LLM和向量模型依赖较重（chromadb、dashscope等），在RAGAgent实例化时再导入
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    from core.vector_store import ChromaVectorStore
+    from core.retriever import HybridRetriever
+    from core.llm_manager import LLMManager
+    from knowledge.vectorizer import Vectorizer
+
+# 系统提示：只包含静态指令、不含检索上下文，每轮逐字节不变，便于服务端前缀缓存跨轮次复用；
+# 检索上下文作为紧随其后的独立系统消息发送
+_SYSTEM_PROMPT = """你是一个专业的力量举训练智能助手。请基于以下知识库信息，为用户提供准确、专业的回答。
+
+回答要求：
+1. 基于知识库信息，提供准确的专业建议
+2. 如果知识库信息不足，请明确说明
+3. 使用中文回答，语言简洁明了
+4. 针对力量举训练相关问题提供具体指导
+5. 注意安全性和科学性
+
+请开始回答用户的问题。"""
+
+# 上下文构建用到的常量
+_CTX_HEADER = "基于以下知识库信息回答用户问题：\n\n"
+_CTX_EMPTY = "没有找到相关的知识库信息。"
+_EMPTY_METADATA: Dict[str, Any] = {}
+# 检索结果数超过该值时改用StringIO逐段写入，避免生成中间字符串
+_CTX_STRINGIO_THRESHOLD = 3
 
 
 # 定义状态类型
@@ -28,15 +51,18 @@ class AgentState(TypedDict):
     messages: List
     context: str
     response: str
+    query_embedding: Optional[np.ndarray]
 
 class RAGAgent:
     """RAG检索增强生成代理"""
     
     def __init__(self, 
-                 vector_store: Optional[ChromaVectorStore] = None,
-                 retriever: Optional[HybridRetriever] = None,
-                 llm_manager: Optional[LLMManager] = None,
-                 vectorizer: Optional[Vectorizer] = None):
+                 vector_store: Optional["ChromaVectorStore"] = None,
+                 retriever: Optional["HybridRetriever"] = None,
+                 llm_manager: Optional["LLMManager"] = None,
+                 vectorizer: Optional["Vectorizer"] = None,
+                 sem_cache_threshold: float = 0.95,
+                 sem_cache_size: int = 10000):
         """
         初始化RAG代理
         
@@ -45,13 +71,30 @@ class RAGAgent:
             retriever: 检索器
             llm_manager: LLM管理器
             vectorizer: 向量化器
+            sem_cache_threshold: 语义缓存命中的余弦相似度阈值
+            sem_cache_size: 语义缓存最大条目数（超出后按FIFO淘汰）
         """
+        from core.vector_store import ChromaVectorStore
+        from core.retriever import HybridRetriever
+        from core.llm_manager import LLMManager
+        from knowledge.vectorizer import Vectorizer
+        
         # 初始化组件
         self.vector_store = vector_store or ChromaVectorStore()
         self.retriever = retriever or HybridRetriever(self.vector_store)
         self.llm_manager = llm_manager or LLMManager()
         self.vectorizer = vectorizer or Vectorizer()
         
+        # 语义缓存：语义相近的问题直接返回已有回答。
+        # 归一化查询向量按行存放在连续矩阵中，回答存放在并行列表中，查询只需一次矩阵向量乘法
+        self.sem_cache_threshold = sem_cache_threshold
+        self.sem_cache_size = sem_cache_size
+        self._cache_vecs: Optional[np.ndarray] = None  # 首次写入时按向量维度分配
+        self._cache_answers: List[str] = []
+        self._cache_count = 0
+        self._cache_next = 0  # 缓存写满后下一个被覆盖的行（FIFO）
+        self._cache_lock = threading.Lock()
+        
         # 构建LangGraph工作流
         self.workflow = self._build_workflow()
         
@@ -65,10 +108,14 @@ class RAGAgent:
         
         # 添加节点
         workflow.add_node("retrieve", self._retrieve_node)
-        workflow.add_node("generate", self._generate_node)
+        workflow.add_node("generate", self._generate_node_stream)
         
-        # 设置边
-        workflow.add_edge("retrieve", "generate")
+        # 设置边：语义缓存命中时跳过生成节点
+        workflow.add_conditional_edges(
+            "retrieve",
+            self._route_after_retrieve,
+            {"generate": "generate", "end": END}
+        )
         workflow.add_edge("generate", END)
         
         # 设置入口点
@@ -78,105 +125,194 @@ class RAGAgent:
     
     def _retrieve_node(self, state: AgentState) -> AgentState:
         """检索节点：从知识库检索相关信息"""
+        # 获取最新的用户消息
+        messages = state["messages"]
+        user_message = messages[-1].content if messages else ""
+        
+        n_results = 3
+        
         try:
-            # 获取最新的用户消息
-            messages = state.get("messages", [])
-            user_message = messages[-1].content if messages else ""
-            
             # 向量化查询
             query_embedding = self.vectorizer.encode_text(user_message)
             
-            # 检索相关文档
+            # 查询语义缓存，命中则跳过检索与生成
+            cached_response = self._lookup_sem_cache(query_embedding)
+            if cached_response is not None:
+                logger.info("语义缓存命中，跳过检索与生成")
+                return {
+                    "messages": messages,
+                    "context": "",
+                    "response": cached_response,
+                    "query_embedding": query_embedding
+                }
+            
+            # 检索相关文档（缓存未命中时才检索；检索器内部并行执行向量检索与BM25检索）
             search_results = self.retriever.search(
                 query=user_message,
                 query_embedding=query_embedding,
-                n_results=3
+                n_results=n_results
             )
             
             # 构建上下文
             context = self._build_context(search_results)
             
-            logger.info(f"检索完成，找到 {len(search_results)} 个相关文档")
+            logger.info("检索完成，找到 {} 个相关文档", len(search_results))
             
             # 返回 TypedDict
             return {
                 "messages": messages,
                 "context": context,
-                "response": ""
+                "response": "",
+                "query_embedding": query_embedding
             }
             
         except Exception as e:
             logger.error(f"检索节点执行失败: {e}")
             return {
-                "messages": state.get("messages", []),
+                "messages": messages,
                 "context": "检索失败，无法获取相关信息。",
-                "response": ""
+                "response": "",
+                "query_embedding": None
             }
     
+    def _route_after_retrieve(self, state: AgentState) -> str:
+        """检索后的路由：已有回答（语义缓存命中）则直接结束"""
+        return "end" if state["response"] else "generate"
     
-    def _generate_node(self, state: AgentState) -> AgentState:
-        """生成节点：基于检索结果生成回答"""
+
+    def _generate_node_stream(self, state: AgentState) -> AgentState:
+        """生成节点：基于检索结果流式生成回答（片段通过workflow.stream的messages模式输出）"""
+        messages = state["messages"]
+        user_message = messages[-1].content if messages else ""
+        context = state["context"]
+        query_embedding = state["query_embedding"]
+        chunks = []
+        
         try:
-            messages = state.get("messages", [])
-            user_message = messages[-1].content if messages else ""
-            
-            # 构建系统提示
-            system_prompt = self._build_system_prompt(state.get("context", ""))
-            
-            # 生成回答
-            response = self.llm_manager.generate_response(
+            # 流式生成回答：[静态系统提示, 检索上下文, 用户问题]，稳定前缀在前；
+            # 调用失败时抛出异常，错误信息不会被当作回答写入语义缓存
+            for chunk in self.llm_manager.stream_response(
                 prompt=user_message,
-                context=state.get("context", ""),
-                system_message=system_prompt
-            )
+                context=context,
+                system_message=_SYSTEM_PROMPT,
+                raise_errors=True
+            ):
+                chunks.append(chunk)
+            response = "".join(chunks)
             
             logger.info("回答生成完成")
             
+            # 只缓存成功生成的回答（LLM不可用时的提示信息不缓存）
+            if self.llm_manager.llm is not None:
+                self._update_sem_cache(query_embedding, response)
+            
             # 返回 TypedDict
             return {
                 "messages": messages,
-                "context": state.get("context", ""),
-                "response": response
+                "context": context,
+                "response": response,
+                "query_embedding": query_embedding
             }
             
         except Exception as e:
             logger.error(f"生成节点执行失败: {e}")
+            # 已流式输出的片段保留在前，chat_stream只需补齐错误信息
             return {
-                "messages": state.get("messages", []),
-                "context": state.get("context", ""),
-                "response": f"生成回答时发生错误: {str(e)}"
+                "messages": messages,
+                "context": context,
+                "response": "".join(chunks) + f"\n\n生成回答时发生错误: {str(e)}",
+                "query_embedding": query_embedding
             }
     
+    def _lookup_sem_cache(self, query_embedding: np.ndarray) -> Optional[str]:
+        """
+        在语义缓存中查找相似问题的回答
+        
+        Args:
+            query_embedding: 查询向量
+            
+        Returns:
+            命中时返回缓存的回答，否则返回None
+        """
+        if self._cache_count == 0 or not np.any(query_embedding):
+            return None
+        
+        # 代理在多个会话间共享：在锁内检索并读取回答，保证向量与回答来自同一次写入
+        with self._cache_lock:
+            # 缓存条目较多时由向量化器的Numba内核并行检索
+            indices, scores = self.vectorizer.search_corpus(
+                query_embedding, self._cache_vecs[:self._cache_count], top_k=1
+            )
+            
+            if len(indices) and scores[0] >= self.sem_cache_threshold:
+                return self._cache_answers[int(indices[0])]
+        return None
+    
+    def _update_sem_cache(self, query_embedding: Optional[np.ndarray], response: str):
+        """
+        将查询向量和回答写入语义缓存
+        
+        Args:
+            query_embedding: 查询向量
+            response: 生成的回答
+        """
+        if query_embedding is None or not response:
+            return
+        
+        norm = np.linalg.norm(query_embedding)
+        if norm == 0:
+            return
+        
+        vec = (query_embedding / norm).astype(np.float32, copy=False)
+        
+        with self._cache_lock:
+            if self._cache_vecs is None:
+                capacity = min(1024, self.sem_cache_size)
+                self._cache_vecs = np.empty((capacity, vec.shape[0]), dtype=np.float32)
+            
+            if self._cache_count < self.sem_cache_size:
+                # 容量不足时按2倍扩容（不超过最大条目数）
+                if self._cache_count == len(self._cache_vecs):
+                    capacity = min(len(self._cache_vecs) * 2, self.sem_cache_size)
+                    grown = np.empty((capacity, vec.shape[0]), dtype=np.float32)
+                    grown[:self._cache_count] = self._cache_vecs[:self._cache_count]
+                    self._cache_vecs = grown
+                
+                row = self._cache_count
+                self._cache_vecs[row] = vec
+                self._cache_answers.append(response)
+                self._cache_count += 1
+            else:
+                # 缓存已满，覆盖最早写入的条目
+                row = self._cache_next
+                self._cache_answers[row] = response
+                self._cache_vecs[row] = vec
+                self._cache_next = (row + 1) % self.sem_cache_size
+    
     def _build_context(self, search_results: List[Dict[str, Any]]) -> str:
         """构建上下文信息"""
         if not search_results:
-            return "没有找到相关的知识库信息。"
+            return _CTX_EMPTY
         
-        context_parts = ["基于以下知识库信息回答用户问题：\n"]
+        if len(search_results) <= _CTX_STRINGIO_THRESHOLD:
+            parts = [
+                f"信息{i} (来源: {(result.get('metadata') or _EMPTY_METADATA).get('file_name', '未知来源')}):\n"
+                f"{result.get('text', '')}\n"
+                for i, result in enumerate(search_results, 1)
+            ]
+            return _CTX_HEADER + "\n".join(parts)
         
+        buf = io.StringIO()
+        buf.write(_CTX_HEADER)
         for i, result in enumerate(search_results, 1):
-            text = result.get('text', '')
-            metadata = result.get('metadata', {})
-            source = metadata.get('file_name', '未知来源')
-            
-            context_parts.append(f"信息{i} (来源: {source}):\n{text}\n")
-        
-        return "\n".join(context_parts)
-    
-    def _build_system_prompt(self, context: str) -> str:
-        """构建系统提示"""
-        return f"""你是一个专业的力量举训练智能助手。请基于以下知识库信息，为用户提供准确、专业的回答。
-
-{context}
-
-回答要求：
-1. 基于知识库信息，提供准确的专业建议
-2. 如果知识库信息不足，请明确说明
-3. 使用中文回答，语言简洁明了
-4. 针对力量举训练相关问题提供具体指导
-5. 注意安全性和科学性
-
-请开始回答用户的问题。"""
+            if i > 1:
+                buf.write("\n")
+            buf.write(f"信息{i} (来源: ")
+            buf.write((result.get('metadata') or _EMPTY_METADATA).get('file_name', '未知来源'))
+            buf.write("):\n")
+            buf.write(result.get('text', ''))
+            buf.write("\n")
+        return buf.getvalue()
     
     def chat(self, user_message: str, conversation_history: List = None) -> str:
         """
@@ -184,27 +320,58 @@ class RAGAgent:
         
         Args:
             user_message: 用户消息
-            conversation_history: 对话历史
+            conversation_history: 对话历史（只读，不会被修改）
             
         Returns:
             代理回答
         """
+        return "".join(self.chat_stream(user_message, conversation_history))
+    
+    def chat_stream(self, user_message: str, conversation_history: List = None) -> Iterator[str]:
+        """
+        与代理进行流式对话
+        
+        Args:
+            user_message: 用户消息
+            conversation_history: 对话历史（只读，不会被修改）
+            
+        Yields:
+            代理回答片段
+        """
         try:
-            # 准备消息历史
-            messages = conversation_history or []
-            messages.append(HumanMessage(content=user_message))
-
+            # 准备消息历史：构建新列表，不修改调用方传入的历史
+            messages = [*(conversation_history or ()), HumanMessage(content=user_message)]
+            
+            initial_state = {
+                "messages": messages,
+                "context": "",
+                "response": "",
+                "query_embedding": None
+            }
             
-            # 执行工作流
-            result = self.workflow.invoke({"messages": messages, "context": "", "response": ""})
+            # 执行工作流：messages模式输出生成节点的LLM片段，values模式输出最终状态
+            streamed = []
+            response = ""
+            for mode, payload in self.workflow.stream(initial_state, stream_mode=["messages", "values"]):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if (isinstance(chunk, AIMessageChunk) and chunk.content
+                            and metadata.get("langgraph_node") == "generate"):
+                        streamed.append(chunk.content)
+                        yield chunk.content
+                else:
+                    response = payload["response"]
             
-            return result["response"]
+            # 未经LLM流式输出的部分（语义缓存命中、错误信息等）在最后补齐
+            streamed_text = "".join(streamed)
+            if response.startswith(streamed_text) and len(response) > len(streamed_text):
+                yield response[len(streamed_text):]
             
         except Exception as e:
             logger.error(f"对话执行失败: {e}")
-            return f"抱歉，处理您的请求时发生错误: {str(e)}"
+            yield f"抱歉，处理您的请求时发生错误: {str(e)}"
     
-    def add_documents(self, documents: List[Document]) -> bool:
+    def add_documents(self, documents: List["Document"]) -> bool:
         """
         添加文档到知识库
         
@@ -222,8 +389,8 @@ class RAGAgent:
             success = self.vector_store.add_documents(doc_data)
             
             if success:
-                # 更新BM25检索器
-                self.retriever.setup_bm25_retriever(documents)
+                # 将新文档并入BM25语料（不覆盖已持久化的完整索引）
+                self.retriever.add_bm25_documents(documents)
                 logger.info(f"成功添加 {len(documents)} 个文档到知识库")
             
             return success
@@ -23,8 +23,6 @@ print(f"修改后的Python路径: {sys.path[:3]}")
 
 from agents.rag_agent import RAGAgent
 from agents.conversation_manager import ConversationManager
-from knowledge.document_loader import DocumentLoader
-from knowledge.text_processor import TextProcessor
 
 class BarbellGPTCLI:
     """BarbellGPT命令行界面"""
@@ -72,6 +70,9 @@ class BarbellGPTCLI:
                 return
 
             # 否则尝试加载文档文件
+            from knowledge.document_loader import DocumentLoader
+            from knowledge.text_processor import TextProcessor
+            
             loader = DocumentLoader()
             doc_info = loader.get_document_info()
 
@@ -113,6 +114,8 @@ class BarbellGPTCLI:
             ]
             
             from langchain.schema import Document
+            from knowledge.text_processor import TextProcessor
+            
             documents = []
             for i, text in enumerate(sample_docs):
                 doc = Document(
@@ -187,10 +190,14 @@ class BarbellGPTCLI:
                 self.session_id, limit=10
             )
             
-            # 生成AI回答
+            # 流式生成AI回答，边生成边输出
             print("\n🤖 AI助手: ", end="", flush=True)
-            ai_response = self.rag_agent.chat(user_input, conversation_history)
-            print(ai_response)
+            chunks = []
+            for chunk in self.rag_agent.chat_stream(user_input, conversation_history):
+                print(chunk, end="", flush=True)
+                chunks.append(chunk)
+            print()
+            ai_response = "".join(chunks)
             
             # 添加AI消息到对话管理器
             self.conversation_manager.add_message(self.session_id, ai_response, is_user=False)
@@ -18,9 +18,10 @@ DOCUMENTS_DIR = DATA_DIR / "documents"
 PROCESSED_DATA_DIR = DATA_DIR / "processed"
 LOGS_DIR = BASE_DIR / "logs"
 
-# 确保目录存在
-for dir_path in [DATA_DIR, DOCUMENTS_DIR, PROCESSED_DATA_DIR, LOGS_DIR]:
-    dir_path.mkdir(parents=True, exist_ok=True)
+# 确保目录存在（已存在时只做一次stat，跳过mkdir系统调用）
+for dir_path in (DATA_DIR, DOCUMENTS_DIR, PROCESSED_DATA_DIR, LOGS_DIR):
+    if not dir_path.is_dir():
+        dir_path.mkdir(parents=True, exist_ok=True)
 
 # 阿里云百炼配置
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
@@ -39,6 +40,8 @@ CHROMA_DB_PATH = (BASE_DIR / "data" / "chroma_db").resolve()
 
 VECTOR_MODEL_NAME = os.getenv("VECTOR_MODEL_NAME", "text-embedding-v4")
 VECTOR_MODEL_PROVIDER = os.getenv("VECTOR_MODEL_PROVIDER", "dashscope")
+# 本地向量模型的推理后端：torch 或 onnx（int8动态量化，适合CPU推理）
+VECTOR_MODEL_BACKEND = os.getenv("VECTOR_MODEL_BACKEND", "torch")
 
 # 应用配置
 DEBUG = os.getenv("DEBUG", "True").lower() == "true"
@@ -53,3 +56,4 @@ LOG_FILE = os.getenv("LOG_FILE", "./logs/barbellgpt.log")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
 TOP_K = int(os.getenv("TOP_K", "5"))
+ENABLE_FAST_CLEAN = os.getenv("ENABLE_FAST_CLEAN", "false").lower() == "true"
@@ -5,7 +5,9 @@ LLM管理器
 """
 
 import os
-from typing import List, Dict, Any, Optional, Union
+import asyncio
+import threading
+from typing import List, Dict, Any, Optional, Union, Iterator
 from loguru import logger
 
 import sys
@@ -18,29 +20,50 @@ os.environ["LANGCHAIN_PROJECT"] = LANGCHAIN_PROJECT
 os.environ["LANGCHAIN_TRACING_V2"] = LANGCHAIN_TRACING_V2
 
 try:
+    import httpx
     from langchain_openai import ChatOpenAI
     from langchain.schema import HumanMessage, SystemMessage, AIMessage
-    from langchain.prompts import PromptTemplate
 except ImportError as e:
     logger.error(f"导入langchain模块失败: {e}")
     raise
 
+# DashScope连接池：复用keep-alive连接，避免每次调用重新进行TCP+TLS握手
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=128, keepalive_expiry=60.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# 上下文消息的固定模板。消息按 [系统消息, 上下文, 用户问题] 排列，稳定内容在前、
+# 动态问题在后，且模板逐字节不变，以命中DashScope/OpenAI兼容接口的前缀缓存。
+# 前缀缓存通常要求公共前缀至少约1024个token，较短的提示不会被缓存。
+CONTEXT_TEMPLATE = "参考资料:\n{context}"
+
+# LLM未初始化时返回的提示
+_NOT_INIT = "LLM模型未初始化，无法生成响应"
+
 class LLMManager:
     """LLM管理器，负责模型连接和调用"""
     
-    def __init__(self, model_name: Optional[str] = None):
+    def __init__(self, model_name: Optional[str] = None,
+                 strict: bool = False):
         """
         初始化LLM管理器
         
         Args:
             model_name: 模型名称，默认使用config中的配置
+            strict: 为True时未设置API Key直接抛出RuntimeError，而不是在每次调用时返回错误提示
         """
         from config import DASHSCOPE_API_KEY, DASHSCOPE_MODEL_NAME
         
         self.api_key = DASHSCOPE_API_KEY
         self.model_name = model_name or DASHSCOPE_MODEL_NAME
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        # 异步连接池中的连接绑定在创建它们的事件循环上，所有异步调用都在这个专用循环中执行
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
         
         if not self.api_key:
+            if strict:
+                raise RuntimeError("未设置DASHSCOPE_API_KEY，无法初始化LLM")
             logger.warning("未设置DASHSCOPE_API_KEY，LLM功能将不可用")
             self.llm = None
         else:
@@ -49,18 +72,55 @@ class LLMManager:
     def _init_llm(self):
         """初始化LLM模型"""
         try:
+            self._http_client = httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+            self._http_async_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+            
             self.llm = ChatOpenAI(
                 model_name=self.model_name,
                 openai_api_key=self.api_key,
                 openai_api_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
                 temperature=0.7,
-                max_tokens=2000
+                max_tokens=2000,
+                http_client=self._http_client,
+                http_async_client=self._http_async_client
             )
             logger.info(f"LLM模型初始化成功: {self.model_name}")
         except Exception as e:
             logger.error(f"LLM模型初始化失败: {e}")
             self.llm = None
     
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """获取专用事件循环（首次调用时在后台线程中启动）"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="llm-event-loop", daemon=True
+                ).start()
+            return self._loop
+    
+    def close(self):
+        """关闭HTTP连接池（同步与异步），并停止专用事件循环"""
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+        
+        async_client, self._http_async_client = self._http_async_client, None
+        loop, self._loop = self._loop, None
+        if loop is not None:
+            if async_client is not None:
+                asyncio.run_coroutine_threadsafe(async_client.aclose(), loop).result(timeout=10)
+            loop.call_soon_threadsafe(loop.stop)
+        elif async_client is not None:
+            # 从未发起过异步请求，连接池中没有绑定到任何事件循环的连接
+            asyncio.run(async_client.aclose())
+    
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+    
     def generate_response(self, prompt: str, 
                          context: Optional[str] = None,
                          system_message: Optional[str] = None) -> str:
@@ -76,22 +136,10 @@ class LLMManager:
             LLM响应
         """
         if not self.llm:
-            return "LLM模型未初始化，无法生成响应"
+            return _NOT_INIT
         
         try:
-            # 构建消息列表
-            messages = []
-            
-            # 系统消息
-            if system_message:
-                messages.append(SystemMessage(content=system_message))
-            
-            # 上下文信息
-            if context:
-                messages.append(SystemMessage(content=f"上下文信息:\n{context}"))
-            
-            # 用户消息
-            messages.append(HumanMessage(content=prompt))
+            messages = self._build_messages(prompt, context, system_message)
             
             # 生成响应
             response = self.llm.invoke(messages)
@@ -103,6 +151,61 @@ class LLMManager:
             logger.error(f"LLM响应生成失败: {e}")
             return f"生成响应时发生错误: {str(e)}"
     
+    def stream_response(self, prompt: str,
+                        context: Optional[str] = None,
+                        system_message: Optional[str] = None,
+                        raise_errors: bool = False) -> Iterator[str]:
+        """
+        流式生成响应
+        
+        Args:
+            prompt: 用户提示
+            context: 上下文信息
+            system_message: 系统消息
+            raise_errors: 为True时调用失败直接抛出异常，而不是输出错误提示，
+                便于调用方区分正常回答与错误信息
+            
+        Yields:
+            LLM响应片段
+        """
+        if not self.llm:
+            yield _NOT_INIT
+            return
+        
+        try:
+            messages = self._build_messages(prompt, context, system_message)
+            
+            for chunk in self.llm.stream(messages):
+                if chunk.content:
+                    yield chunk.content
+            
+            logger.info("LLM流式响应生成成功")
+            
+        except Exception as e:
+            logger.error(f"LLM流式响应生成失败: {e}")
+            if raise_errors:
+                raise
+            yield f"生成响应时发生错误: {str(e)}"
+    
+    def _build_messages(self, prompt: str,
+                        context: Optional[str] = None,
+                        system_message: Optional[str] = None) -> List:
+        """构建发送给LLM的消息列表（稳定前缀在前，用户问题在最后，见CONTEXT_TEMPLATE）"""
+        messages = []
+        
+        # 系统消息
+        if system_message:
+            messages.append(SystemMessage(content=system_message))
+        
+        # 上下文信息
+        if context:
+            messages.append(SystemMessage(content=CONTEXT_TEMPLATE.format(context=context)))
+        
+        # 用户消息（每次调用变化的内容只放在这里）
+        messages.append(HumanMessage(content=prompt))
+        
+        return messages
+    
     def generate_with_template(self, template: str, 
                               variables: Dict[str, Any]) -> str:
         """
@@ -116,17 +219,11 @@ class LLMManager:
             LLM响应
         """
         if not self.llm:
-            return "LLM模型未初始化，无法生成响应"
+            return _NOT_INIT
         
         try:
-            # 创建提示模板
-            prompt_template = PromptTemplate(
-                template=template,
-                input_variables=list(variables.keys())
-            )
-            
-            # 格式化提示
-            formatted_prompt = prompt_template.format(**variables)
+            # 格式化提示（直接使用str.format_map，无需构建PromptTemplate对象）
+            formatted_prompt = template.format_map(variables)
             
             # 生成响应
             messages = [HumanMessage(content=formatted_prompt)]
@@ -139,31 +236,46 @@ class LLMManager:
             logger.error(f"模板化LLM响应生成失败: {e}")
             return f"生成响应时发生错误: {str(e)}"
     
-    def batch_generate(self, prompts: List[str]) -> List[str]:
+    def batch_generate(self, prompts: List[str], max_concurrent: int = 32) -> List[str]:
         """
-        批量生成响应
+        批量生成响应（并发请求，结果顺序与提示顺序一致）
         
         Args:
             prompts: 提示列表
+            max_concurrent: 最大并发请求数
             
         Returns:
             响应列表
         """
         if not self.llm:
-            return ["LLM模型未初始化"] * len(prompts)
-        
-        responses = []
-        for i, prompt in enumerate(prompts):
-            try:
-                messages = [HumanMessage(content=prompt)]
-                response = self.llm.invoke(messages)
-                responses.append(response.content)
-                logger.info(f"批量生成进度: {i+1}/{len(prompts)}")
-            except Exception as e:
-                logger.error(f"批量生成失败 (提示 {i+1}): {e}")
-                responses.append(f"生成失败: {str(e)}")
-        
-        return responses
+            return [_NOT_INIT] * len(prompts)
+        
+        future = asyncio.run_coroutine_threadsafe(
+            self._abatch_generate(prompts, max_concurrent), self._get_loop()
+        )
+        return future.result()
+    
+    async def _abatch_generate(self, prompts: List[str], max_concurrent: int) -> List[str]:
+        """使用信号量限制并发，异步批量生成响应"""
+        semaphore = asyncio.Semaphore(max_concurrent)
+        completed = 0
+        
+        async def generate_one(i: int, prompt: str) -> str:
+            nonlocal completed
+            async with semaphore:
+                try:
+                    messages = [HumanMessage(content=prompt)]
+                    response = await self.llm.ainvoke(messages)
+                    completed += 1
+                    logger.info(f"批量生成进度: {completed}/{len(prompts)}")
+                    return response.content
+                except Exception as e:
+                    logger.error(f"批量生成失败 (提示 {i+1}): {e}")
+                    return f"生成失败: {str(e)}"
+        
+        return list(await asyncio.gather(
+            *(generate_one(i, prompt) for i, prompt in enumerate(prompts))
+        ))
     
     def get_model_info(self) -> Dict[str, Any]:
         """
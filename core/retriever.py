@@ -5,52 +5,226 @@
 """
 
 import re
+import json
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
 from typing import List, Dict, Any, Optional
 import numpy as np
 from loguru import logger
 
 try:
+    import bm25s
     from langchain.schema import Document
-    from langchain_community.retrievers import BM25Retriever
 except ImportError as e:
     logger.error(f"导入langchain模块失败: {e}")
     raise
 
+# 可选依赖：jieba中文分词，未安装时退化为汉字二元组
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+# 连续汉字片段或连续字母数字片段
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+")
+_ZH_STOPWORDS = frozenset("的 了 是 在 和 与 及 或 也 就 都 而 但 对 把 被 从 等 这 那 个 之 于 以 为 其".split())
+
+# 索引使用的分词方式，持久化索引与当前分词方式不一致时需重建
+TOKENIZER_NAME = "jieba" if jieba is not None else "zh-bigram"
+
+
+def tokenize_zh(text: str) -> List[str]:
+    """
+    中英文混合分词
+    
+    bm25s默认的\\w\\w+分词不切分中文，整段汉字会成为一个词。这里对汉字片段使用jieba
+    搜索引擎模式分词（未安装时取相邻汉字二元组），字母数字片段按整词保留。
+    
+    Args:
+        text: 文本
+        
+    Returns:
+        词列表
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if not "\u4e00" <= run[0] <= "\u9fff":
+            tokens.append(run)
+        elif jieba is not None:
+            tokens.extend(w for w in jieba.lcut_for_search(run) if w not in _ZH_STOPWORDS)
+        elif len(run) == 1:
+            if run not in _ZH_STOPWORDS:
+                tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+@dataclass(slots=True, frozen=True)
+class _BM25State:
+    """BM25索引及与索引行号一一对应的文本块、分词结果"""
+    retriever: Any
+    corpus: List[Dict[str, Any]]
+    tokens: Optional[List[List[str]]]
+
+
+@dataclass(slots=True)
+class _FusedResult:
+    """RRF融合过程中的候选结果"""
+    text: str
+    metadata: Dict[str, Any]
+    id: str
+    rrf_score: float = 0.0
+
+
 class HybridRetriever:
     """混合检索器，结合向量搜索和关键词搜索"""
     
-    def __init__(self, vector_store, vector_weight: float = 0.7):
+    def __init__(self, vector_store, rrf_k: int = 60, index_dir: Optional[Path] = None):
         """
         初始化混合检索器
         
         Args:
             vector_store: 向量存储管理器
-            vector_weight: 向量搜索权重 (0-1)
+            rrf_k: 倒数排名融合(RRF)的平滑常数
+            index_dir: BM25索引的持久化目录，默认为config中的处理数据目录
         """
+        from config import PROCESSED_DATA_DIR
+        
         self.vector_store = vector_store
-        self.vector_weight = vector_weight
-        self.keyword_weight = 1.0 - vector_weight
+        self.rrf_k = rrf_k
+        self.index_dir = index_dir or PROCESSED_DATA_DIR / "bm25_index"
+        
+        # BM25索引状态（索引、文本块、分词结果）整体替换，检索线程不会看到索引与文本块不一致的中间状态；
+        # 写入方通过锁串行化，避免并发追加时丢失更新
+        self._bm25: Optional[_BM25State] = None
+        self._bm25_lock = threading.Lock()
         
-        # 关键词检索器（用于文本匹配）
-        self.bm25_retriever = None
+        # 向量检索与BM25检索相互独立，并行执行（ChromaDB与BM25打分的C实现会释放GIL）
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid-search")
+        
+        # 启动时直接加载已持久化的索引，无需重新分词建索引
+        self.load_bm25_index()
+    
+    @property
+    def bm25_retriever(self):
+        """当前的BM25索引，未设置时为None"""
+        state = self._bm25
+        return state.retriever if state is not None else None
         
     def setup_bm25_retriever(self, documents: List[Document]):
         """
-        设置BM25关键词检索器
+        用完整语料设置BM25关键词检索器，并将索引持久化到磁盘
         
         Args:
-            documents: 文档列表
+            documents: 全部文档列表（替换已有索引）
         """
+        corpus = [{'text': doc.page_content, 'metadata': doc.metadata} for doc in documents]
+        with self._bm25_lock:
+            self._build_bm25_index(corpus, [tokenize_zh(item['text']) for item in corpus])
+    
+    def add_bm25_documents(self, documents: List[Document]):
+        """
+        将新文档并入已有语料后重建BM25索引（按文本去重，只对新文本分词）
+        
+        Args:
+            documents: 新增文档列表
+        """
+        with self._bm25_lock:
+            state = self._bm25
+            corpus = list(state.corpus) if state is not None else []
+            if state is None:
+                tokens = []
+            elif state.tokens is not None:
+                tokens = list(state.tokens)
+            else:
+                # 从旧版本索引加载时没有分词结果，补算一次
+                tokens = [tokenize_zh(item['text']) for item in corpus]
+            
+            positions = {item['text']: i for i, item in enumerate(corpus)}
+            for doc in documents:
+                item = {'text': doc.page_content, 'metadata': doc.metadata}
+                i = positions.get(doc.page_content)
+                if i is None:
+                    positions[doc.page_content] = len(corpus)
+                    corpus.append(item)
+                    tokens.append(tokenize_zh(doc.page_content))
+                else:
+                    corpus[i] = item
+            
+            self._build_bm25_index(corpus, tokens)
+    
+    def _build_bm25_index(self, corpus: List[Dict[str, Any]], tokens: List[List[str]]):
+        """对已分词的语料建索引、整体替换当前状态并持久化（调用方持有_bm25_lock）"""
         try:
-            self.bm25_retriever = BM25Retriever.from_documents(documents)
+            retriever = bm25s.BM25()
+            retriever.index(tokens, show_progress=False)
+            
+            self._bm25 = _BM25State(retriever, corpus, tokens)
             logger.info("BM25检索器设置完成")
+            
+            self._save_bm25_index()
         except Exception as e:
             logger.error(f"设置BM25检索器失败: {e}")
     
+    def _save_bm25_index(self):
+        """持久化BM25索引、对应的文本块及其分词结果"""
+        state = self._bm25
+        try:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            state.retriever.save(str(self.index_dir))
+            with open(self.index_dir / "documents.json", "w", encoding="utf-8") as f:
+                json.dump(state.corpus, f, ensure_ascii=False)
+            with open(self.index_dir / "tokens.json", "w", encoding="utf-8") as f:
+                json.dump(state.tokens, f, ensure_ascii=False)
+            (self.index_dir / "tokenizer.txt").write_text(TOKENIZER_NAME, encoding="utf-8")
+            logger.info(f"BM25索引已保存: {self.index_dir}")
+        except Exception as e:
+            logger.warning(f"保存BM25索引失败: {e}")
+    
+    def load_bm25_index(self) -> bool:
+        """
+        从磁盘加载BM25索引（内存映射方式）
+        
+        Returns:
+            是否加载成功
+        """
+        corpus_path = self.index_dir / "documents.json"
+        if not corpus_path.exists():
+            return False
+        
+        # 分词方式不一致时索引词表无法与查询对应，需重新建索引
+        tokenizer_path = self.index_dir / "tokenizer.txt"
+        tokenizer = tokenizer_path.read_text(encoding="utf-8").strip() if tokenizer_path.exists() else None
+        if tokenizer != TOKENIZER_NAME:
+            logger.warning(f"BM25索引分词方式({tokenizer})与当前({TOKENIZER_NAME})不一致，请重新构建知识库")
+            return False
+        
+        try:
+            retriever = bm25s.BM25.load(str(self.index_dir), mmap=True)
+            with open(corpus_path, "r", encoding="utf-8") as f:
+                corpus = json.load(f)
+            tokens = None
+            tokens_path = self.index_dir / "tokens.json"
+            if tokens_path.exists():
+                with open(tokens_path, "r", encoding="utf-8") as f:
+                    tokens = json.load(f)
+            
+            self._bm25 = _BM25State(retriever, corpus, tokens)
+            logger.info(f"加载BM25索引: {self.index_dir}，共 {len(corpus)} 个文本块")
+            return True
+        except Exception as e:
+            logger.warning(f"加载BM25索引失败: {e}")
+            return False
+    
     def search(self, query: str, 
                query_embedding: np.ndarray,
                n_results: int = 5,
-               filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+               filter_metadata: Optional[Dict[str, Any]] = None,
+               keyword_results: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         """
         混合搜索
         
@@ -59,41 +233,33 @@ class HybridRetriever:
             query_embedding: 查询向量
             n_results: 返回结果数量
             filter_metadata: 元数据过滤条件
+            keyword_results: 预先计算的关键词搜索结果（传入时跳过BM25检索）
             
         Returns:
             混合搜索结果
         """
         try:
-            # 1. 向量搜索
+            # 1. 关键词搜索（如果有BM25检索器且未预先计算），在后台线程中与向量搜索并行
+            keyword_future = None
+            if keyword_results is None and self.bm25_retriever:
+                keyword_future = self._executor.submit(self.keyword_search, query, n_results * 2)
+            
+            # 2. 向量搜索
             vector_results = self.vector_store.search(
                 query_embedding=query_embedding,
                 n_results=n_results * 2,  # 获取更多候选结果
                 filter_metadata=filter_metadata
             )
             
-            # 2. 关键词搜索（如果有BM25检索器）
-            keyword_results = []
-            if self.bm25_retriever:
-                try:
-                    keyword_docs = self.bm25_retriever.get_relevant_documents(query)
-                    keyword_results = [
-                        {
-                            'text': doc.page_content,
-                            'metadata': doc.metadata,
-                            'id': doc.metadata.get('id', ''),
-                            'score': 1.0  # BM25没有距离分数
-                        }
-                        for doc in keyword_docs[:n_results * 2]
-                    ]
-                except Exception as e:
-                    logger.warning(f"关键词搜索失败: {e}")
+            if keyword_future is not None:
+                keyword_results = keyword_future.result()
             
             # 3. 结果融合
             combined_results = self._merge_results(
-                vector_results, keyword_results, n_results
+                vector_results, keyword_results or [], n_results
             )
             
-            logger.info(f"混合搜索完成，返回 {len(combined_results)} 个结果")
+            logger.info("混合搜索完成，返回 {} 个结果", len(combined_results))
             return combined_results
             
         except Exception as e:
@@ -104,62 +270,40 @@ class HybridRetriever:
                       keyword_results: List[Dict], 
                       n_results: int) -> List[Dict]:
         """
-        融合向量搜索和关键词搜索结果
+        使用倒数排名融合(RRF)合并向量搜索和关键词搜索结果
+        
+        score(d) = Σ 1 / (k + rank_i(d))，只依赖各路结果的排名，
+        不受向量距离与BM25分数量纲不一致的影响
         
         Args:
-            vector_results: 向量搜索结果
-            keyword_results: 关键词搜索结果
+            vector_results: 向量搜索结果（按相关度排序）
+            keyword_results: 关键词搜索结果（按相关度排序）
             n_results: 最终结果数量
             
         Returns:
             融合后的结果
         """
-        # 创建结果映射
-        result_map = {}
-        
-        # 处理向量搜索结果
-        for i, result in enumerate(vector_results):
-            doc_id = result.get('id', f'vec_{i}')
-            if doc_id not in result_map:
-                result_map[doc_id] = {
-                    'text': result['text'],
-                    'metadata': result['metadata'],
-                    'id': doc_id,
-                    'vector_score': 1.0 - (result.get('distance', 0) or 0),
-                    'keyword_score': 0.0,
-                    'combined_score': 0.0
-                }
+        # 以文本块内容作为融合键：BM25结果不带向量库ID，同一文本块在两路结果中内容一致
+        result_map: Dict[str, _FusedResult] = {}
+        rrf_k = self.rrf_k
         
-        # 处理关键词搜索结果
-        for i, result in enumerate(keyword_results):
-            doc_id = result.get('id', f'kw_{i}')
-            if doc_id in result_map:
-                result_map[doc_id]['keyword_score'] = result.get('score', 0.0)
-            else:
-                result_map[doc_id] = {
-                    'text': result['text'],
-                    'metadata': result['metadata'],
-                    'id': doc_id,
-                    'vector_score': 0.0,
-                    'keyword_score': result.get('score', 0.0),
-                    'combined_score': 0.0
-                }
+        for prefix, results in (('vec', vector_results), ('kw', keyword_results)):
+            for rank, result in enumerate(results, 1):
+                text = result['text']
+                entry = result_map.get(text)
+                if entry is None:
+                    entry = result_map[text] = _FusedResult(
+                        text, result['metadata'], result.get('id') or f'{prefix}_{rank}'
+                    )
+                entry.rrf_score += 1.0 / (rrf_k + rank)
         
-        # 计算综合分数
-        for result in result_map.values():
-            result['combined_score'] = (
-                self.vector_weight * result['vector_score'] +
-                self.keyword_weight * result['keyword_score']
-            )
+        # 只取RRF分数最高的前N个，无需对全部候选排序
+        top = heapq.nlargest(n_results, result_map.values(), key=lambda x: x.rrf_score)
         
-        # 按综合分数排序并返回前N个结果
-        sorted_results = sorted(
-            result_map.values(),
-            key=lambda x: x['combined_score'],
-            reverse=True
-        )
-        
-        return sorted_results[:n_results]
+        return [
+            {'text': r.text, 'metadata': r.metadata, 'id': r.id, 'rrf_score': r.rrf_score}
+            for r in top
+        ]
     
     def semantic_search(self, query_embedding: np.ndarray, 
                        n_results: int = 5,
@@ -192,20 +336,34 @@ class HybridRetriever:
         Returns:
             关键词搜索结果
         """
-        if not self.bm25_retriever:
+        # 取一次状态快照，索引与文本块始终来自同一次构建
+        state = self._bm25
+        if state is None:
             logger.warning("BM25检索器未设置，无法进行关键词搜索")
             return []
         
+        corpus = state.corpus
+        k = min(n_results, len(corpus))
+        if k <= 0:
+            return []
+        
         try:
-            docs = self.bm25_retriever.get_relevant_documents(query)
+            # 只保留索引词表中的词，全部未登录时直接返回
+            vocab = state.retriever.vocab_dict
+            query_tokens = [t for t in tokenize_zh(query) if t in vocab]
+            if not query_tokens:
+                return []
+            
+            indices, scores = state.retriever.retrieve([query_tokens], k=k, show_progress=False)
+            
             return [
                 {
-                    'text': doc.page_content,
-                    'metadata': doc.metadata,
-                    'id': doc.metadata.get('id', ''),
-                    'score': 1.0
+                    'text': corpus[idx]['text'],
+                    'metadata': corpus[idx]['metadata'],
+                    'id': corpus[idx]['metadata'].get('id', ''),
+                    'score': float(score)
                 }
-                for doc in docs[:n_results]
+                for idx, score in zip(indices[0].tolist(), scores[0].tolist())
             ]
         except Exception as e:
             logger.error(f"关键词搜索失败: {e}")
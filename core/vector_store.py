@@ -5,6 +5,7 @@
 """
 
 import os
+import hashlib
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Union
 import numpy as np
@@ -18,6 +19,9 @@ except ImportError as e:
     logger.error(f"导入chromadb模块失败: {e}")
     raise
 
+# 单次写入ChromaDB的最大条数，避免超过其单批次上限
+ADD_BATCH_SIZE = 1000
+
 class ChromaVectorStore:
     """ChromaDB向量存储管理器"""
     
@@ -84,26 +88,27 @@ class ChromaVectorStore:
             return True
             
         try:
-            # 准备数据
-            ids = []
-            embeddings = []
-            metadatas = []
-            texts = []
-            
-            for i, doc_data in enumerate(documents):
-                doc_id = f"doc_{i}_{hash(doc_data['text'])}"
-                ids.append(doc_id)
-                embeddings.append(doc_data['embedding'].tolist())
-                metadatas.append(doc_data['metadata'])
-                texts.append(doc_data['text'])
-            
-            # 批量添加到集合
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                metadatas=metadatas,
-                documents=texts
+            # 相同文本在同一批次内只保留最后一条，避免重复ID
+            unique_docs = list({doc_data['text']: doc_data for doc_data in documents}.values())
+            
+            # 准备数据：ID由文本内容确定，重复导入同一语料时覆盖而不是新增
+            texts = [doc_data['text'] for doc_data in unique_docs]
+            ids = [self.make_doc_id(text) for text in texts]
+            # 向量堆叠为一个连续的float32矩阵直接传给ChromaDB，不逐行转换为Python列表
+            embeddings = np.ascontiguousarray(
+                np.stack([doc_data['embedding'] for doc_data in unique_docs]), dtype=np.float32
             )
+            metadatas = [doc_data['metadata'] for doc_data in unique_docs]
+            
+            # 分批写入集合
+            for start in range(0, len(ids), ADD_BATCH_SIZE):
+                end = start + ADD_BATCH_SIZE
+                self.collection.upsert(
+                    ids=ids[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadatas[start:end],
+                    documents=texts[start:end]
+                )
             
             logger.info(f"成功添加 {len(documents)} 个文档到向量数据库")
             return True
@@ -112,6 +117,19 @@ class ChromaVectorStore:
             logger.error(f"添加文档到向量数据库失败: {e}")
             return False
     
+    @staticmethod
+    def make_doc_id(text: str) -> str:
+        """
+        根据文本内容生成稳定的文档ID（跨进程一致）
+        
+        Args:
+            text: 文档文本
+            
+        Returns:
+            文档ID
+        """
+        return f"doc_{hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()}"
+    
     def search(self, query_embedding: np.ndarray, 
                n_results: int = 5, 
                filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
@@ -127,9 +145,10 @@ class ChromaVectorStore:
             搜索结果列表
         """
         try:
-            # 执行搜索
+            # 以二维float32数组直接传入，避免每次查询都转换为Python列表
+            query = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
             results = self.collection.query(
-                query_embeddings=[query_embedding.tolist()],
+                query_embeddings=query,
                 n_results=n_results,
                 where=filter_metadata
             )
@@ -137,16 +156,16 @@ class ChromaVectorStore:
             # 格式化结果
             formatted_results = []
             if results['documents'] and results['documents'][0]:
-                for i in range(len(results['documents'][0])):
-                    result = {
-                        'text': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'id': results['ids'][0][i],
-                        'distance': results['distances'][0][i] if 'distances' in results else None
-                    }
-                    formatted_results.append(result)
-            
-            logger.info(f"向量搜索完成，返回 {len(formatted_results)} 个结果")
+                docs = results['documents'][0]
+                metas = results['metadatas'][0]
+                ids = results['ids'][0]
+                distances = results['distances'][0] if results.get('distances') else [None] * len(docs)
+                formatted_results = [
+                    {'text': text, 'metadata': metadata, 'id': doc_id, 'distance': distance}
+                    for text, metadata, doc_id, distance in zip(docs, metas, ids, distances)
+                ]
+            
+            logger.info("向量搜索完成，返回 {} 个结果", len(formatted_results))
             return formatted_results
             
         except Exception as e:
@@ -7,8 +7,9 @@
 from .document_loader import DocumentLoader
 from .text_processor import TextProcessor
 from .vectorizer import Vectorizer
+from .embedding_cache import EmbeddingCache
 
-__all__ = ["DocumentLoader", "TextProcessor", "Vectorizer"]
+__all__ = ["DocumentLoader", "TextProcessor", "Vectorizer", "EmbeddingCache"]
 
 # 版本信息
 __version__ = "0.1.0" 
\ No newline at end of file
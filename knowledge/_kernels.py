@@ -0,0 +1,58 @@
+"""
+Numba加速的向量计算内核
+
+仅在安装了numba时可用，由向量化器在CPU上检索大语料时调用。
+"""
+
+import numpy as np
+from numba import njit, prange
+
+# 并行分块数：每块在各自线程中维护局部top-k，最后合并
+_N_BLOCKS = 64
+# top-k缓冲区的初始分数。fastmath下不能假设inf参与比较的结果，使用有限值：
+# 归一化向量的余弦相似度不小于-1
+_SCORE_SENTINEL = -2.0
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def topk_cosine(documents, query, k):
+    """
+    融合点积与部分top-k选择，不生成完整的相似度数组
+
+    Args:
+        documents: 已归一化的文档向量矩阵 (N, D)，float32
+        query: 已归一化的查询向量 (D,)，float32
+        k: 返回结果数量（1 <= k <= N）
+
+    Returns:
+        (下标数组, 相似度数组)，按相似度降序
+    """
+    n, dim = documents.shape
+    n_blocks = min(n, _N_BLOCKS)
+    block = (n + n_blocks - 1) // n_blocks
+
+    best_scores = np.full((n_blocks, k), _SCORE_SENTINEL, dtype=np.float32)
+    best_idx = np.full((n_blocks, k), -1, dtype=np.int64)
+
+    for b in prange(n_blocks):
+        scores = best_scores[b]
+        idx = best_idx[b]
+        for i in range(b * block, min((b + 1) * block, n)):
+            s = 0.0
+            for j in range(dim):
+                s += documents[i, j] * query[j]
+            # k通常很小，用有序数组插入代替堆
+            if s > scores[k - 1]:
+                pos = k - 1
+                while pos > 0 and scores[pos - 1] < s:
+                    scores[pos] = scores[pos - 1]
+                    idx[pos] = idx[pos - 1]
+                    pos -= 1
+                scores[pos] = s
+                idx[pos] = i
+
+    # 合并各块的局部top-k
+    flat_scores = best_scores.ravel()
+    flat_idx = best_idx.ravel()
+    order = np.argsort(-flat_scores)[:k]
+    return flat_idx[order], flat_scores[order]
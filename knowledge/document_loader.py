@@ -5,8 +5,9 @@
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 from loguru import logger
 
 try:
@@ -39,6 +40,11 @@ class DocumentLoader:
             '.docx': Docx2txtLoader,
             '.md': UnstructuredMarkdownLoader,
         }
+        # 解析开销小、以IO为主的格式，并行加载时使用线程池；其余格式（PDF等）使用进程池绕开GIL
+        self.io_bound_extensions = {'.txt'}
+        
+        # get_document_info的缓存：(文档目录修改时间, 统计信息)
+        self._doc_info_cache: Optional[tuple] = None
         
     def load_document(self, file_path: Path) -> List[Document]:
         """
@@ -76,31 +82,86 @@ class DocumentLoader:
             logger.error(f"加载文档失败 {file_path}: {e}")
             return []
     
-    def load_all_documents(self) -> List[Document]:
+    def list_supported_files(self) -> List[Path]:
         """
-        加载文档目录中的所有支持格式的文档
+        列出文档目录中所有支持格式的文件
         
         Returns:
-            所有文档的列表
+            文件路径列表
         """
-        all_documents = []
-        
         if not self.documents_dir.exists():
             logger.warning(f"文档目录不存在: {self.documents_dir}")
-            return all_documents
+            return []
+        
+        return [
+            Path(entry.path) for entry in self._walk_files(str(self.documents_dir))
+            if os.path.splitext(entry.name)[1].lower() in self.supported_extensions
+        ]
+    
+    def load_all_documents(self, max_workers: Optional[int] = None) -> List[Document]:
+        """
+        加载文档目录中的所有支持格式的文档（多个文件时并行加载）
+        
+        Args:
+            max_workers: 并行加载的最大工作进程/线程数，默认为CPU核数
             
-        for file_path in self.documents_dir.rglob("*"):
-            if file_path.is_file() and file_path.suffix.lower() in self.supported_extensions:
-                documents = self.load_document(file_path)
-                all_documents.extend(documents)
+        Returns:
+            所有文档的列表
+        """
+        all_documents = []
+        paths = self.list_supported_files()
+        
+        loaded = None
+        if len(paths) > 1:
+            try:
+                loaded = self._load_parallel(paths, max_workers or os.cpu_count() or 1)
+            except Exception as e:
+                logger.warning(f"并行加载文档失败，改为顺序加载: {e}")
+        
+        if loaded is None:
+            loaded = []
+            for file_path in paths:
+                loaded.extend(self.load_document(file_path))
+        all_documents.extend(loaded)
                 
         logger.info(f"总共加载了 {len(all_documents)} 个文档")
         return all_documents
     
-    def get_document_info(self) -> Dict[str, Any]:
+    def _load_parallel(self, paths: List[Path], max_workers: int) -> List[Document]:
+        """并行加载多个文件，结果保持文件顺序"""
+        all_documents = []
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as process_pool, \
+                ThreadPoolExecutor(max_workers=max_workers) as thread_pool:
+            futures = [
+                (thread_pool if file_path.suffix.lower() in self.io_bound_extensions else process_pool)
+                .submit(self.load_document, file_path)
+                for file_path in paths
+            ]
+            for future in futures:
+                all_documents.extend(future.result())
+        
+        return all_documents
+    
+    @classmethod
+    def _walk_files(cls, path: str) -> Iterator[os.DirEntry]:
+        """递归遍历目录下的文件（使用os.scandir，复用目录项缓存的类型信息）"""
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from cls._walk_files(entry.path)
+                elif entry.is_file():
+                    yield entry
+    
+    def get_document_info(self, refresh: bool = False) -> Dict[str, Any]:
         """
         获取文档目录的统计信息
         
+        结果按文档目录的修改时间缓存；只改动子目录内容时目录本身的修改时间不变，需传入refresh=True
+        
+        Args:
+            refresh: 是否忽略缓存重新统计
+            
         Returns:
             文档统计信息
         """
@@ -111,18 +172,26 @@ class DocumentLoader:
             'file_types': {},
         }
         
-        if not self.documents_dir.exists():
+        try:
+            dir_mtime = os.stat(self.documents_dir).st_mtime_ns
+        except FileNotFoundError:
             return info
-            
-        for file_path in self.documents_dir.rglob("*"):
-            if file_path.is_file():
+        
+        cached = self._doc_info_cache
+        if cached is None or refresh or cached[0] != dir_mtime:
+            file_types = info['file_types']
+            for entry in self._walk_files(str(self.documents_dir)):
                 info['total_files'] += 1
-                file_extension = file_path.suffix.lower()
+                file_extension = os.path.splitext(entry.name)[1].lower()
                 
                 if file_extension in self.supported_extensions:
                     info['supported_files'] += 1
-                    info['file_types'][file_extension] = info['file_types'].get(file_extension, 0) + 1
+                    file_types[file_extension] = file_types.get(file_extension, 0) + 1
                 else:
                     info['unsupported_files'] += 1
-                    
-        return info 
\ No newline at end of file
+            
+            cached = self._doc_info_cache = (dir_mtime, info)
+        
+        # 返回副本，调用方修改结果不影响缓存
+        info = cached[1]
+        return {**info, 'file_types': dict(info['file_types'])}
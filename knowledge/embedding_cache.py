@@ -0,0 +1,116 @@
+"""
+向量磁盘缓存
+
+以文本内容哈希为键，将向量以float16持久化到SQLite，重建知识库时未变化的文本块无需重新编码。
+"""
+
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from loguru import logger
+
+# SQLite单条语句的参数个数上限（旧版本为999）
+_MAX_SQL_PARAMS = 900
+
+
+class EmbeddingCache:
+    """基于SQLite的向量缓存：blake2b(模型名 + 文本) -> float16向量"""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        """
+        初始化向量缓存
+
+        Args:
+            db_path: 缓存数据库文件路径，默认为向量数据库目录下的embeddings_cache.sqlite
+        """
+        from config import CHROMA_DB_PATH
+
+        self.db_path = db_path or CHROMA_DB_PATH / "embeddings_cache.sqlite"
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # 同一连接可能被检索线程和构建线程共用，读写通过锁串行化
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(hash BLOB PRIMARY KEY, dim INT, vec BLOB)"
+        )
+        self._conn.commit()
+
+        logger.info(f"向量缓存初始化完成: {self.db_path}")
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> bytes:
+        """计算缓存键"""
+        return hashlib.blake2b(f"{model_name}\x00{text}".encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        批量查询缓存的向量
+
+        Args:
+            model_name: 向量模型键（模型名称及影响向量结果的配置）
+            texts: 文本列表
+
+        Returns:
+            与texts一一对应的向量列表，未命中为None
+        """
+        keys = [self.make_key(model_name, text) for text in texts]
+        found = {}
+
+        try:
+            with self._lock:
+                for start in range(0, len(keys), _MAX_SQL_PARAMS):
+                    batch = keys[start:start + _MAX_SQL_PARAMS]
+                    rows = self._conn.execute(
+                        f"SELECT hash, vec FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall()
+                    found.update(rows)
+        except sqlite3.Error as e:
+            logger.warning(f"读取向量缓存失败: {e}")
+            return [None] * len(texts)
+
+        return [
+            np.frombuffer(found[key], dtype=np.float16).astype(np.float32) if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, model_name: str, texts: List[str], embeddings: np.ndarray):
+        """
+        批量写入向量（单个事务）
+
+        Args:
+            model_name: 向量模型键（模型名称及影响向量结果的配置）
+            texts: 文本列表
+            embeddings: 与texts一一对应的向量矩阵
+        """
+        if not texts:
+            return
+
+        vectors = np.asarray(embeddings, dtype=np.float16)
+        rows = [
+            (self.make_key(model_name, text), vectors.shape[1], vec.tobytes())
+            for text, vec in zip(texts, vectors)
+        ]
+
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (hash, dim, vec) VALUES (?, ?, ?)", rows
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"写入向量缓存失败: {e}")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -5,6 +5,7 @@
 """
 
 import re
+from functools import partial
 from typing import List, Dict, Any, Optional
 from loguru import logger
 
@@ -15,34 +16,67 @@ except ImportError as e:
     logger.error(f"导入langchain模块失败: {e}")
     raise
 
+# 可选：Rust实现的文本分割器，已安装时替代纯Python的RecursiveCharacterTextSplitter
+try:
+    from semantic_text_splitter import TextSplitter as FastTextSplitter
+except ImportError:
+    FastTextSplitter = None
+
+# 可选：第三方regex模块，匹配时可释放GIL，多线程清洗时各线程真正并行
+try:
+    import regex as fast_regex
+except ImportError:
+    fast_regex = None
+
+# 中文文本清洗规则
+KEEP_PATTERN = r'[^\w\s\u4e00-\u9fff。，！？；："（）【】\-]'  # 保留中文、英文、数字和基本标点
+WS_PATTERN = r'\s+'  # 多个空白字符替换为单个空格
+
 class TextProcessor:
     """文本处理器，负责文档清洗、分块和预处理"""
     
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 fast_clean: Optional[bool] = None):
         """
         初始化文本处理器
         
         Args:
             chunk_size: 文本块大小
             chunk_overlap: 文本块重叠大小
+            fast_clean: 是否使用regex模块清洗文本，默认使用config中的ENABLE_FAST_CLEAN
         """
+        from config import ENABLE_FAST_CLEAN
+        
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         
-        # 初始化文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
-        )
-        
-        # 中文文本清洗规则
-        self.cleanup_patterns = [
-            (r'\s+', ' '),  # 多个空白字符替换为单个空格
-            (r'[^\w\s\u4e00-\u9fff。，！？；：""''（）【】\-]', ''),  # 保留中文、英文、数字和基本标点
-            (r'^\s+|\s+$', ''),  # 去除首尾空白
-        ]
+        # 初始化文本分割器：优先使用编译实现（按Unicode句子/词边界切分，同样适用于中文），
+        # 未安装semantic-text-splitter时回退到LangChain的递归分割器
+        if FastTextSplitter is not None:
+            self.text_splitter = FastTextSplitter(capacity=chunk_size, overlap=chunk_overlap)
+        else:
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                length_function=len,
+                separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
+            )
+        
+        # 中文文本清洗规则（预编译），启用快速清洗且已安装regex模块时使用regex引擎
+        if fast_clean is None:
+            fast_clean = ENABLE_FAST_CLEAN
+        if fast_clean and fast_regex is not None:
+            self._keep_re = fast_regex.compile(KEEP_PATTERN)
+            self._ws_re = fast_regex.compile(WS_PATTERN)
+            self._keep_sub = partial(self._keep_re.sub, '', concurrent=True)
+            self._ws_sub = partial(self._ws_re.sub, ' ', concurrent=True)
+        else:
+            if fast_clean:
+                logger.warning("未安装regex模块，使用标准re清洗文本")
+            self._keep_re = re.compile(KEEP_PATTERN)
+            self._ws_re = re.compile(WS_PATTERN)
+            self._keep_sub = partial(self._keep_re.sub, '')
+            self._ws_sub = partial(self._ws_re.sub, ' ')
         
     def clean_text(self, text: str) -> str:
         """
@@ -57,17 +91,44 @@ class TextProcessor:
         if not text or not isinstance(text, str):
             return ""
             
-        cleaned_text = text
-        
-        # 应用清洗规则
-        for pattern, replacement in self.cleanup_patterns:
-            cleaned_text = re.sub(pattern, replacement, cleaned_text)
+        # 先删除无关字符再合并空白，避免删除字符后残留连续空格；首尾空白用strip去除
+        cleaned_text = self._ws_sub(self._keep_sub(text)).strip()
             
         # 去除过短的文本
-        if len(cleaned_text.strip()) < 10:
+        if len(cleaned_text) < 10:
             return ""
             
-        return cleaned_text.strip()
+        return cleaned_text
+    
+    def clean_texts(self, texts: List[str]) -> List[str]:
+        """
+        批量清洗文本，规则与clean_text一致
+        
+        Args:
+            texts: 原始文本列表
+            
+        Returns:
+            清洗后的文本列表（与输入一一对应，过短或无效的文本为空字符串）
+        """
+        # 预先绑定正则方法，避免逐条调用clean_text的函数调用和属性查找开销
+        keep_sub = self._keep_sub
+        ws_sub = self._ws_sub
+        cleaned = [
+            ws_sub(keep_sub(text)).strip() if text and isinstance(text, str) else ""
+            for text in texts
+        ]
+        return [text if len(text) >= 10 else "" for text in cleaned]
+    
+    def _clean_documents(self, documents: List[Document]) -> List[Document]:
+        """批量清洗文档内容，只保留清洗后非空的文档"""
+        cleaned_contents = self.clean_texts([doc.page_content for doc in documents])
+        
+        cleaned_docs = []
+        for doc, cleaned_content in zip(documents, cleaned_contents):
+            if cleaned_content:
+                doc.page_content = cleaned_content
+                cleaned_docs.append(doc)
+        return cleaned_docs
     
     def split_documents(self, documents: List[Document]) -> List[Document]:
         """
@@ -83,16 +144,20 @@ class TextProcessor:
             return []
             
         try:
-            # 使用LangChain的文本分割器
-            split_docs = self.text_splitter.split_documents(documents)
+            if FastTextSplitter is not None:
+                # 一次调用分割全部文档，分块按来源下标映射回原文档的元数据
+                all_chunks = self.text_splitter.chunk_all([doc.page_content for doc in documents])
+                split_docs = [
+                    Document(page_content=chunk, metadata=dict(doc.metadata))
+                    for doc, chunks in zip(documents, all_chunks)
+                    for chunk in chunks
+                ]
+            else:
+                # 使用LangChain的文本分割器
+                split_docs = self.text_splitter.split_documents(documents)
             
-            # 清洗每个文档块
-            cleaned_docs = []
-            for doc in split_docs:
-                cleaned_content = self.clean_text(doc.page_content)
-                if cleaned_content:  # 只保留非空内容
-                    doc.page_content = cleaned_content
-                    cleaned_docs.append(doc)
+            # 清洗每个文档块，只保留非空内容
+            cleaned_docs = self._clean_documents(split_docs)
                     
             logger.info(f"文档分割完成: {len(documents)} -> {len(cleaned_docs)} 块")
             return cleaned_docs
@@ -117,12 +182,7 @@ class TextProcessor:
         logger.info(f"开始处理 {len(documents)} 个文档")
         
         # 1. 清洗原始文档
-        cleaned_docs = []
-        for doc in documents:
-            cleaned_content = self.clean_text(doc.page_content)
-            if cleaned_content:
-                doc.page_content = cleaned_content
-                cleaned_docs.append(doc)
+        cleaned_docs = self._clean_documents(documents)
                 
         logger.info(f"文档清洗完成: {len(documents)} -> {len(cleaned_docs)}")
         
@@ -5,7 +5,11 @@
 """
 
 import os
-from typing import List, Dict, Any, Optional, Union
+import math
+import asyncio
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Union
 import numpy as np
 from loguru import logger
 
@@ -20,21 +24,80 @@ except ImportError as e:
     logger.error(f"导入sentence_transformers模块失败: {e}")
     raise
 
+# 可选：SimSIMD提供AVX-512/NEON手写的余弦距离内核
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+# 可选：Numba融合的点积+top-k内核，检索大向量矩阵时才导入（导入numba较慢）
+_topk_kernel = None
+
+from knowledge.embedding_cache import EmbeddingCache
+
+# 阿里云百炼单次请求最多可编码的文本数：v1/v2支持25条，v3/v4为10条
+DASHSCOPE_MAX_BATCH_SIZE = {
+    "text-embedding-v1": 25,
+    "text-embedding-v2": 25,
+}
+DASHSCOPE_DEFAULT_BATCH_SIZE = 10
+
+
+def _load_topk_kernel():
+    """首次调用时导入Numba top-k内核，未安装numba时返回None"""
+    global _topk_kernel
+    if _topk_kernel is None:
+        try:
+            from knowledge._kernels import topk_cosine
+        except ImportError:
+            topk_cosine = False
+        _topk_kernel = topk_cosine
+    return _topk_kernel or None
+
+
 class Vectorizer:
     """向量化器，负责文本到向量的转换"""
     
-    def __init__(self, model_name: Optional[str] = None, device: Optional[str] = None):
+    def __init__(self, model_name: Optional[str] = None, device: Optional[str] = None,
+                 dashscope_batch_size: Optional[int] = None, max_concurrent_requests: int = 16,
+                 embedding_cache: Optional[EmbeddingCache] = None, use_cache: bool = True,
+                 max_seq_length: Optional[int] = None, show_progress: bool = False):
         """
         初始化向量化器
         
         Args:
             model_name: 向量模型名称，默认使用config中的配置
             device: 计算设备，默认自动选择
+            dashscope_batch_size: 阿里云百炼单次请求编码的文本数，默认取该模型支持的上限
+            max_concurrent_requests: 阿里云百炼并发请求数上限
+            embedding_cache: 向量磁盘缓存，默认在向量数据库目录下创建
+            use_cache: 是否启用向量磁盘缓存
+            max_seq_length: 本地模型的最大序列长度，建议设为语料token数的99分位，默认使用模型配置
+            show_progress: 本地模型批量编码时是否显示进度条
         """
-        from config import VECTOR_MODEL_NAME, VECTOR_MODEL_PROVIDER
+        from config import VECTOR_MODEL_NAME, VECTOR_MODEL_PROVIDER, VECTOR_MODEL_BACKEND
         
         self.model_name = model_name or VECTOR_MODEL_NAME
         self.provider = VECTOR_MODEL_PROVIDER
+        self.backend = VECTOR_MODEL_BACKEND
+        self.dashscope_batch_size = dashscope_batch_size or DASHSCOPE_MAX_BATCH_SIZE.get(
+            self.model_name, DASHSCOPE_DEFAULT_BATCH_SIZE
+        )
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_seq_length = max_seq_length
+        self.show_progress = show_progress
+        
+        # encode_text/encode_texts返回的向量均已L2归一化（零向量除外），
+        # 余弦相似度即点积，向量库中存储的也是归一化向量
+        self.normalized = True
+        
+        # 向量磁盘缓存：相同文本（同一模型）只编码一次
+        self.embedding_cache = None
+        if use_cache:
+            try:
+                self.embedding_cache = embedding_cache or EmbeddingCache()
+            except Exception as e:
+                logger.warning(f"向量缓存初始化失败，不使用缓存: {e}")
         
         # 自动选择设备
         if device is None:
@@ -46,8 +109,19 @@ class Vectorizer:
         else:
             self.device = device
             
-        # 初始化模型
-        self._load_model()
+        # 模型延迟到首次编码时加载，避免初始化（如界面首次渲染）被模型加载阻塞
+        self.model = None
+        # 阿里云百炼text-embedding-v4的维度是1024；本地模型的维度在加载时记录
+        self._dim: Optional[int] = 1024 if self.provider == "dashscope" else None
+        self._zero_vec: Optional[np.ndarray] = None  # 只读零向量，无效输入时返回其副本
+        self._model_lock = threading.Lock()
+        
+    def _ensure_model(self):
+        """确保模型已加载（首次调用时加载，线程安全）"""
+        if self.model is None:
+            with self._model_lock:
+                if self.model is None:
+                    self._load_model()
         
     def _load_model(self):
         """加载向量模型"""
@@ -60,14 +134,62 @@ class Vectorizer:
                 logger.info(f"正在加载阿里云百炼向量模型: {self.model_name}")
             else:
                 # 使用本地SentenceTransformer模型
-                logger.info(f"正在加载本地向量模型: {self.model_name} (设备: {self.device})")
-                self.model = SentenceTransformer(self.model_name, device=self.device)
+                logger.info(f"正在加载本地向量模型: {self.model_name} (设备: {self.device}, 后端: {self.backend})")
+                # 设备只通过构造参数device指定，不要在加载后再调用.to()，
+                # 否则模型的目标设备可能与实际设备不一致，导致张量在前向传播间被移回CPU
+                # 模型配置完成后才赋值给self.model，其他线程不会看到未配置完的模型
+                if self.backend == "onnx":
+                    model = self._load_onnx_model()
+                else:
+                    model = SentenceTransformer(self.model_name, device=self.device)
+                self._check_device(model)
+                if self.max_seq_length:
+                    model.max_seq_length = self.max_seq_length
+                self._dim = model.get_sentence_embedding_dimension()
+                self.model = model
             
             logger.info("向量模型加载完成")
         except Exception as e:
             logger.error(f"向量模型加载失败: {e}")
             raise
     
+    def _check_device(self, model: SentenceTransformer):
+        """校验模型所在设备与配置一致；使用CUDA时开启cuDNN自动调优"""
+        model_device = getattr(model, "device", None)
+        if model_device is not None and getattr(model_device, "type", str(model_device)) != self.device.split(":")[0]:
+            logger.warning(f"向量模型设备与配置不一致: 配置 {self.device}, 实际 {model_device}")
+        
+        if self.device.startswith("cuda"):
+            import torch
+            torch.backends.cudnn.benchmark = True
+            torch.set_float32_matmul_precision("high")
+    
+    def _load_onnx_model(self) -> SentenceTransformer:
+        """
+        加载int8动态量化的ONNX模型，首次使用时导出并量化，结果缓存到~/.cache/barbellgpt/onnx
+        
+        Returns:
+            使用ONNX Runtime推理的SentenceTransformer模型
+        """
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        
+        quantization = "avx512_vnni"
+        file_name = f"onnx/model_qint8_{quantization}.onnx"
+        cache_dir = Path.home() / ".cache" / "barbellgpt" / "onnx" / self.model_name.replace("/", "__")
+        
+        if not (cache_dir / file_name).exists():
+            logger.info(f"导出并量化ONNX模型: {cache_dir}")
+            model = SentenceTransformer(self.model_name, device=self.device, backend="onnx")
+            model.save(str(cache_dir))
+            export_dynamic_quantized_onnx_model(model, quantization, str(cache_dir))
+        
+        return SentenceTransformer(
+            str(cache_dir),
+            device=self.device,
+            backend="onnx",
+            model_kwargs={"file_name": file_name}
+        )
+    
     def encode_text(self, text: str) -> np.ndarray:
         """
         编码单个文本
@@ -80,8 +202,9 @@ class Vectorizer:
         """
         try:
             if not text or not isinstance(text, str):
-                return np.zeros(self.get_embedding_dimension())
+                return self._zero_vector()
             
+            self._ensure_model()
             if self.provider == "dashscope":
                 # 使用阿里云百炼API
                 response = self.model.call(
@@ -91,18 +214,18 @@ class Vectorizer:
                     output_type = "dense&sparse")
                 if response.status_code == 200:
                     embedding = np.array(response.output['embeddings'][0]['embedding'])
-                    return embedding
                 else:
                     logger.error(f"阿里云百炼API调用失败: {response.message}")
-                    return np.zeros(self.get_embedding_dimension())
+                    return self._zero_vector()
             else:
                 # 使用本地模型编码
                 embedding = self.model.encode(text, convert_to_numpy=True)
-                return embedding
+            
+            return self._normalize_inplace(embedding)
             
         except Exception as e:
             logger.error(f"文本编码失败: {e}")
-            return np.zeros(self.get_embedding_dimension())
+            return self._zero_vector()
     
     def encode_texts(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
         """
@@ -113,64 +236,133 @@ class Vectorizer:
             batch_size: 批处理大小
             
         Returns:
-            文本向量矩阵
+            文本向量矩阵（float16）
         """
         if not texts:
             return np.array([])
             
         try:
             # 过滤空文本
-            valid_texts = [text for text in texts if text and isinstance(text, str)]
+            mask = np.fromiter(
+                (bool(text) and isinstance(text, str) for text in texts),
+                dtype=bool, count=len(texts)
+            )
+            valid_texts = [text for text, valid in zip(texts, mask) if valid]
             
             if not valid_texts:
-                if self.provider == "dashscope":
-                    return np.zeros((len(texts), self.get_embedding_dimension()))
-                else:
-                    return np.zeros((len(texts), self.model.get_sentence_embedding_dimension()))
+                return np.zeros((len(texts), self.get_embedding_dimension()), dtype=np.float16)
                 
-            if self.provider == "dashscope":
-                # 阿里云百炼批量编码
-                embeddings = []
-                for text in valid_texts:
-                    response = self.model.call(
-                        model = self.model_name,
-                        input = text,
-                        dimension = 1024,
-                        output_type = "dense&sparse")
-                    if response.status_code == 200:
-                        embedding = np.array(response.output['embeddings'][0]['embedding'])
-                        embeddings.append(embedding)
-                    else:
-                        logger.error(f"阿里云百炼API调用失败: {response.message}")
-                        embeddings.append(np.zeros(self.get_embedding_dimension()))
-                embeddings = np.array(embeddings)
+            self._ensure_model()
+            if self.embedding_cache is not None:
+                embeddings = self._encode_with_cache(valid_texts, batch_size)
             else:
-                # 使用本地模型批量编码
-                embeddings = self.model.encode(
-                    valid_texts, 
-                    batch_size=batch_size,
-                    convert_to_numpy=True,
-                    show_progress_bar=True
-                )
+                embeddings = self._embed_texts(valid_texts, batch_size)
             
-            # 如果有些文本被过滤了，需要填充零向量
-            if len(valid_texts) < len(texts):
-                full_embeddings = np.zeros((len(texts), embeddings.shape[1]))
-                valid_idx = 0
-                for i, text in enumerate(texts):
-                    if text and isinstance(text, str):
-                        full_embeddings[i] = embeddings[valid_idx]
-                        valid_idx += 1
+            # 如果有些文本被过滤了，被过滤的位置填充零向量
+            if not mask.all():
+                full_embeddings = np.zeros((len(texts), embeddings.shape[1]), dtype=embeddings.dtype)
+                full_embeddings[mask] = embeddings
                 embeddings = full_embeddings
                 
-            return embeddings
+            # 以float16返回，批量入库流程中的内存占用减半；相似度计算和写入向量库时再转为float32
+            return self._normalize_inplace(embeddings).astype(np.float16)
             
         except Exception as e:
             logger.error(f"批量文本编码失败: {e}")
-            if self.provider == "dashscope":
-                return np.zeros((len(texts), self.get_embedding_dimension()))
-            else:
-                return np.zeros((len(texts), self.model.get_sentence_embedding_dimension()))
+            return np.zeros((len(texts), self.get_embedding_dimension()), dtype=np.float16)
+    
+    def _embed_texts(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """调用模型编码非空文本列表（不经过缓存）"""
+        if self.provider == "dashscope":
+            # 阿里云百炼批量编码：多条文本合并为一次请求，多个请求并发发送
+            return asyncio.run(self._encode_dashscope(texts))
+        
+        # 使用本地模型批量编码：按长度排序后分批，同一批次内长度接近，减少padding浪费
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        embeddings = self.model.encode(
+            [texts[i] for i in order], 
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=self.show_progress
+        )
+        
+        # 还原为输入顺序
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return embeddings[inverse]
+    
+    def _encode_with_cache(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """先查磁盘缓存，只编码未命中的文本并写回缓存"""
+        cache_key = self._cache_key()
+        cached = self.embedding_cache.get_many(cache_key, texts)
+        miss_idx = [i for i, vec in enumerate(cached) if vec is None]
+        
+        if miss_idx:
+            miss_texts = [texts[i] for i in miss_idx]
+            new_embeddings = self._embed_texts(miss_texts, batch_size)
+            
+            # 编码失败得到的零向量不写入缓存
+            ok = np.any(new_embeddings, axis=1)
+            self.embedding_cache.put_many(
+                cache_key,
+                [text for text, keep in zip(miss_texts, ok) if keep],
+                new_embeddings[ok]
+            )
+            for i, vec in zip(miss_idx, new_embeddings):
+                cached[i] = vec
+        
+        logger.info(f"向量缓存命中 {len(texts) - len(miss_idx)}/{len(texts)}")
+        return np.stack(cached)
+    
+    def _cache_key(self) -> str:
+        """向量缓存的模型键：同名模型换用不同后端、维度或最大序列长度时向量不同，不能共用缓存"""
+        return (f"{self.model_name}|{self.provider}|{self.backend}|"
+                f"{self.get_embedding_dimension()}|{self.max_seq_length or 'default'}")
+    
+    async def _encode_dashscope(self, texts: List[str]) -> np.ndarray:
+        """
+        并发调用阿里云百炼批量编码文本
+        
+        Args:
+            texts: 非空文本列表
+            
+        Returns:
+            文本向量矩阵（顺序与输入一致，失败的批次为零向量）
+        """
+        dim = self.get_embedding_dimension()
+        batch_size = self.dashscope_batch_size
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        
+        # 预分配输出矩阵，各批次直接写入对应行，避免逐条收集后再整体复制；
+        # 以零初始化，响应中缺失的行保持为零向量而不是未初始化的内存
+        out = np.zeros((len(texts), dim), dtype=np.float32)
+        
+        async def encode_batch(start: int):
+            batch = texts[start:start + batch_size]
+            async with semaphore:
+                try:
+                    # SDK调用是同步的，放到线程中执行以便并发
+                    response = await asyncio.to_thread(
+                        self.model.call,
+                        model=self.model_name,
+                        input=batch,
+                        dimension=dim,
+                        output_type="dense&sparse"
+                    )
+                    if response.status_code == 200:
+                        for item in response.output['embeddings']:
+                            out[start + item['text_index']] = item['embedding']
+                        return
+                    logger.error(f"阿里云百炼API调用失败: {response.message}")
+                except Exception as e:
+                    logger.error(f"阿里云百炼API调用失败: {e}")
+                out[start:start + len(batch)] = 0.0
+        
+        await asyncio.gather(*(
+            encode_batch(start) for start in range(0, len(texts), batch_size)
+        ))
+        return out
     
     def encode_documents(self, documents: List[Document], 
                         batch_size: int = 32) -> List[Dict[str, Any]]:
@@ -182,7 +374,7 @@ class Vectorizer:
             batch_size: 批处理大小
             
         Returns:
-            包含文档和向量的字典列表
+            包含文档和向量的字典列表（metadata为原文档metadata的引用）
         """
         if not documents:
             return []
@@ -194,16 +386,11 @@ class Vectorizer:
             # 批量编码
             embeddings = self.encode_texts(texts, batch_size)
             
-            # 组合结果
-            results = []
-            for i, doc in enumerate(documents):
-                result = {
-                    'document': doc,
-                    'embedding': embeddings[i],
-                    'text': doc.page_content,
-                    'metadata': doc.metadata.copy()
-                }
-                results.append(result)
+            # 组合结果。metadata与原文档共享同一个字典（不复制），下游如需修改应自行复制
+            results = [
+                {'document': doc, 'embedding': embedding, 'text': doc.page_content, 'metadata': doc.metadata}
+                for doc, embedding in zip(documents, embeddings)
+            ]
                 
             logger.info(f"文档编码完成: {len(documents)} 个文档")
             return results
@@ -217,41 +404,107 @@ class Vectorizer:
         获取向量维度
         
         Returns:
-            向量维度
+            向量维度（encode_texts返回float16向量，每维2字节）
         """
-        if self.provider == "dashscope":
-            # 阿里云百炼text-embedding-v4的维度是1024
-            return 1024
-        else:
-            return self.model.get_sentence_embedding_dimension()
+        if self._dim is None:
+            self._ensure_model()
+        return self._dim
+    
+    def _zero_vector(self) -> np.ndarray:
+        """返回零向量（无效输入或编码失败时使用）"""
+        if self._zero_vec is None:
+            zero_vec = np.zeros(self.get_embedding_dimension(), dtype=np.float32)
+            zero_vec.setflags(write=False)
+            self._zero_vec = zero_vec
+        return self._zero_vec.copy()
+    
+    @staticmethod
+    def _normalize_inplace(embeddings: np.ndarray) -> np.ndarray:
+        """
+        原地将向量（或向量矩阵的每一行）归一化为单位长度，零向量保持为零
+        
+        einsum一次遍历求出各行模长的平方，再原地相除，不分配与输入同样大小的临时数组
+        """
+        if not embeddings.flags.writeable or not np.issubdtype(embeddings.dtype, np.floating):
+            embeddings = embeddings.astype(np.float32)
+        norms = np.sqrt(np.einsum('...i,...i->...', embeddings, embeddings))[..., None]
+        np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+        return embeddings
     
     def compute_similarity(self, embedding1: np.ndarray, 
-                          embedding2: np.ndarray) -> float:
+                          embedding2: np.ndarray,
+                          normalized: Optional[bool] = None) -> float:
         """
         计算两个向量的余弦相似度
         
         Args:
             embedding1: 第一个向量
             embedding2: 第二个向量
+            normalized: 输入是否已归一化，默认为self.normalized（由本向量化器编码的向量均已归一化）
             
         Returns:
             相似度分数 (0-1)
-        """
-        try:
-            # 归一化向量
-            norm1 = np.linalg.norm(embedding1)
-            norm2 = np.linalg.norm(embedding2)
             
-            if norm1 == 0 or norm2 == 0:
+        Raises:
+            ValueError: 两个向量不是一维或维度不一致
+        """
+        # 转为连续float32，点积走BLAS的SDOT内核而不是逐元素的通用循环
+        embedding1 = np.ascontiguousarray(embedding1, dtype=np.float32)
+        embedding2 = np.ascontiguousarray(embedding2, dtype=np.float32)
+        
+        if embedding1.ndim != 1 or embedding1.shape != embedding2.shape:
+            raise ValueError(f"向量维度不一致: {embedding1.shape} 与 {embedding2.shape}")
+        if embedding1.size == 0:
+            return 0.0
+        
+        # 已归一化的向量，余弦相似度即点积
+        if self.normalized if normalized is None else normalized:
+            return float(np.dot(embedding1, embedding2))
+        
+        if simsimd is not None:
+            # 编码失败时得到零向量，与NumPy实现保持一致返回0
+            if not embedding1.any() or not embedding2.any():
                 return 0.0
-                
-            # 计算余弦相似度
-            similarity = np.dot(embedding1, embedding2) / (norm1 * norm2)
-            return float(similarity)
-            
-        except Exception as e:
-            logger.error(f"相似度计算失败: {e}")
+            return 1.0 - float(simsimd.cosine(embedding1, embedding2))
+        
+        # 两个模长平方的乘积只开一次方
+        den2 = float(np.vdot(embedding1, embedding1)) * float(np.vdot(embedding2, embedding2))
+        if den2 == 0.0:
             return 0.0
+            
+        # 计算余弦相似度
+        return float(np.dot(embedding1, embedding2)) / math.sqrt(den2)
+    
+    def search_corpus(self, query: np.ndarray, documents: np.ndarray,
+                      top_k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在已归一化的向量矩阵中检索与查询最相似的top_k个向量
+        
+        Args:
+            query: 查询向量 (D,)
+            documents: 已归一化的连续float32向量矩阵 (N, D)
+            top_k: 返回结果数量
+            
+        Returns:
+            (下标数组, 相似度数组)，按相似度降序
+        """
+        n = len(documents)
+        k = min(top_k, n)
+        if k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        
+        q = self._normalize_inplace(np.array(query, dtype=np.float32).ravel())
+        
+        # 大矩阵：Numba内核并行计算并直接选出top-k，不生成完整的相似度数组
+        if n > 1000:
+            topk_cosine = _load_topk_kernel()
+            if topk_cosine is not None:
+                return topk_cosine(documents, q, k)
+        
+        scores = documents @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
     
     def get_model_info(self) -> Dict[str, Any]:
         """
@@ -260,6 +513,7 @@ class Vectorizer:
         Returns:
             模型信息字典
         """
+        self._ensure_model()
         return {
             'model_name': self.model_name,
             'device': self.device,
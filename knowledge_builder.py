@@ -5,22 +5,61 @@
 """
 
 import os
+import queue
+import shutil
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from typing import List, Optional
 from loguru import logger
 from knowledge.document_loader import DocumentLoader
 from knowledge.text_processor import TextProcessor
 from knowledge.vectorizer import Vectorizer
 from core.vector_store import ChromaVectorStore
-from config import CHROMA_DB_PATH, CHUNK_SIZE, CHUNK_OVERLAP
+from core.retriever import HybridRetriever
+from config import CHROMA_DB_PATH, CHUNK_SIZE, CHUNK_OVERLAP, PROCESSED_DATA_DIR
+
+try:
+    from langchain.schema import Document
+except ImportError as e:
+    logger.error(f"导入langchain模块失败: {e}")
+    raise
+
+# 进程池工作进程内的加载器与文本处理器，由_init_worker在每个进程中创建一次
+_worker_loader: Optional[DocumentLoader] = None
+_worker_processor: Optional[TextProcessor] = None
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int):
+    """进程池初始化：在工作进程中创建加载器和文本处理器，避免每个任务序列化它们"""
+    global _worker_loader, _worker_processor
+    _worker_loader = DocumentLoader()
+    _worker_processor = TextProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _load_and_process_in_worker(file_path: Path) -> List[Document]:
+    """在工作进程中加载单个文件并完成清洗和分块"""
+    return _worker_processor.process_documents(_worker_loader.load_document(file_path))
+
 
 class KnowledgeBaseBuilder:
     """知识库构建器"""
     
-    def __init__(self):
+    def __init__(self, batch_size: int = 512, max_workers: Optional[int] = None,
+                 queue_size: int = 64):
+        """
+        Args:
+            batch_size: 每批向量化并写入向量数据库的文本块数
+            max_workers: 并行加载、清洗和分块文件的工作进程/线程数，默认为CPU核数
+            queue_size: 同时在途（加载中或已分块但尚未入库）的文件数上限，用于限制内存占用
+        """
+        self.batch_size = batch_size
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
         self.document_loader = DocumentLoader()
         self.text_processor = TextProcessor(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-        self.vectorizer = Vectorizer()
+        self.vectorizer = Vectorizer(show_progress=True)
         self.vector_store = ChromaVectorStore()
+        self.bm25_index_dir = PROCESSED_DATA_DIR / "bm25_index"
         
     def build_knowledge_base(self, force_rebuild: bool = False):
         """
@@ -39,28 +78,24 @@ class KnowledgeBaseBuilder:
             logger.warning("没有找到支持的文档文件")
             return False
             
-        # 2. 加载文档
-        documents = self.document_loader.load_all_documents()
-        logger.info(f"加载了 {len(documents)} 个文档")
-        
-        # 3. 文本处理
-        processed_chunks = self.text_processor.process_documents(documents)
-        logger.info(f"生成了 {len(processed_chunks)} 个文本块")
-        
-        # 4. 向量化文档
-        encoded_docs = self.vectorizer.encode_documents(processed_chunks)
-        logger.info(f"向量化完成: {len(encoded_docs)} 个文档")
-        
-        # 5. 存储到向量数据库
         if force_rebuild:
             # 删除现有集合
             self.vector_store.delete_collection()
             # 重新初始化
             self.vector_store = ChromaVectorStore()
-            
-        success = self.vector_store.add_documents(encoded_docs)
+            # 同时删除旧的BM25索引，避免构建失败时留下与向量库不一致的索引
+            shutil.rmtree(self.bm25_index_dir, ignore_errors=True)
+        
+        # 2. 流水线：工作进程/线程逐文件完成加载、清洗和分块，主线程按批向量化并入库，
+        #    解析与向量化重叠进行，内存中只保留队列中的文本块
+        success, stored_chunks = self._run_pipeline(self.document_loader.list_supported_files())
+        logger.info(f"生成并向量化了 {len(stored_chunks)} 个文本块")
         
         if success:
+            # 3. 用全部入库的文本块重建BM25关键词索引并持久化，与向量库保持一致
+            retriever = HybridRetriever(self.vector_store, index_dir=self.bm25_index_dir)
+            retriever.setup_bm25_retriever(stored_chunks)
+            
             # 显示统计信息
             info = self.vector_store.get_collection_info()
             logger.info(f"知识库构建完成！统计信息: {info}")
@@ -68,6 +103,91 @@ class KnowledgeBaseBuilder:
             logger.error("知识库构建失败")
             
         return success
+    
+    def _load_and_process(self, file_path: Path) -> List[Document]:
+        """加载单个文件并完成清洗和分块"""
+        return self.text_processor.process_documents(self.document_loader.load_document(file_path))
+    
+    def _run_pipeline(self, paths: List[Path]) -> tuple:
+        """
+        运行加载 -> 分块 -> 向量化 -> 入库的流水线，各阶段重叠执行
+        
+        PDF、DOCX等解析受GIL限制，在进程池中加载；TXT以IO为主，在线程池中加载（与DocumentLoader并行加载的划分一致）
+        
+        Args:
+            paths: 待处理的文件列表
+            
+        Returns:
+            (是否成功, 已入库的文本块列表（不含向量，用于构建BM25索引）)
+        """
+        # 同时在途的文件数不超过queue_size，已完成但未入库的文本块数量随之受限
+        chunk_queue: "queue.Queue[List[Document]]" = queue.Queue()
+        io_bound = self.document_loader.io_bound_extensions
+        path_iter = iter(paths)
+        
+        def on_done(future: Future, file_path: Path):
+            # 每个任务恰好放入一个结果（失败时为空列表），主线程据此计数
+            try:
+                chunks = future.result()
+            except Exception as e:
+                logger.error(f"处理文档失败 {file_path}: {e}")
+                chunks = []
+            chunk_queue.put(chunks)
+        
+        def submit_next() -> bool:
+            file_path = next(path_iter, None)
+            if file_path is None:
+                return False
+            if file_path.suffix.lower() in io_bound:
+                future = thread_pool.submit(self._load_and_process, file_path)
+            else:
+                future = process_pool.submit(_load_and_process_in_worker, file_path)
+            future.add_done_callback(lambda f: on_done(f, file_path))
+            return True
+        
+        success = True
+        stored_chunks: List[Document] = []
+        pending: List[Document] = []
+        insert_future: Optional[Future] = None
+        
+        def flush() -> bool:
+            # 向量化当前批次的同时，上一批次在入库线程中写入；写入队列深度为1
+            nonlocal insert_future
+            encoded_docs = self.vectorizer.encode_documents(pending)
+            stored_chunks.extend(pending)
+            pending.clear()
+            
+            ok = insert_future.result() if insert_future is not None else True
+            insert_future = insert_executor.submit(self.vector_store.add_documents, encoded_docs)
+            return ok
+        
+        processor = self.text_processor
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                 initargs=(processor.chunk_size, processor.chunk_overlap)) as process_pool, \
+                ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="kb-load") as thread_pool, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-insert") as insert_executor:
+            in_flight = 0
+            while in_flight < self.queue_size and submit_next():
+                in_flight += 1
+            
+            while in_flight:
+                chunks = chunk_queue.get()
+                in_flight -= 1
+                if not success:
+                    continue  # 已失败：不再提交新文件，只等待在途任务结束
+                
+                pending.extend(chunks)
+                if len(pending) >= self.batch_size and not flush():
+                    success = False
+                elif submit_next():
+                    in_flight += 1
+            
+            if success and pending:
+                success = flush()
+            if insert_future is not None:
+                success = insert_future.result() and success
+        
+        return success, stored_chunks
 
 def main():
     """主函数"""
@@ -6,6 +6,7 @@ BarbellGPT 主程序
 
 import os
 import sys
+import importlib.util
 from pathlib import Path
 from loguru import logger
 
@@ -43,12 +44,11 @@ def check_dependencies():
         'chromadb', 'sentence_transformers', 'loguru'
     ]
     
-    missing_packages = []
-    for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
-            missing_packages.append(package)
+    # 只解析模块路径，不执行模块的顶层代码，避免启动时导入重量级依赖
+    missing_packages = [
+        package for package in required_packages
+        if importlib.util.find_spec(package) is None
+    ]
     
     if missing_packages:
         logger.error(f"缺少依赖包: {', '.join(missing_packages)}")
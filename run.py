@@ -6,12 +6,18 @@ BarbellGPT 启动脚本
 
 import subprocess
 import sys
+import importlib.util
 from pathlib import Path
 
 def main():
     """启动BarbellGPT"""
     print("🏋️ 启动 BarbellGPT...")
     
+    # 未安装streamlit时直接退出，不必启动子进程
+    if importlib.util.find_spec("streamlit") is None:
+        print("❌ 缺少依赖包: streamlit，请运行: pip install -r requirements.txt")
+        sys.exit(1)
+    
     # 获取项目根目录
     project_root = Path(__file__).parent
     
@@ -56,7 +56,7 @@ def test_core_modules():
         
         # 测试检索器
         retriever = HybridRetriever(vector_store)
-        print(f"  ✅ 检索器: 向量权重 {retriever.vector_weight}")
+        print(f"  ✅ 检索器: RRF常数 {retriever.rrf_k}")
         
         # 测试LLM管理器
         llm_manager = LLMManager()
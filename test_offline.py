@@ -85,6 +85,158 @@ def test_simple_conversation():
         print(f"  ❌ 对话测试失败: {e}")
         return False
 
+def test_rrf_merge():
+    """测试RRF融合排序"""
+    print("🧪 测试RRF融合...")
+    
+    try:
+        import tempfile
+        from core.retriever import HybridRetriever
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            retriever = HybridRetriever(vector_store=None, rrf_k=60, index_dir=Path(tmp))
+        
+        def results(*texts):
+            return [{'text': t, 'metadata': {}} for t in texts]
+        
+        # B: 1/62+1/61 > A: 1/61+1/63；D只在关键词结果中排第1，高于只在向量结果中排第3的C
+        merged = retriever._merge_results(results("A", "B", "C"), results("B", "D", "A"), n_results=3)
+        order = [r['text'] for r in merged]
+        assert order == ["B", "A", "D"], order
+        assert merged[0]['rrf_score'] > merged[1]['rrf_score'] > merged[2]['rrf_score']
+        print(f"  ✅ RRF融合: {order}")
+        
+        return True
+        
+    except Exception as e:
+        print(f"  ❌ RRF融合测试失败: {e!r}")
+        return False
+
+def test_bm25_persistence():
+    """测试BM25中文分词索引的持久化与加载"""
+    print("🧪 测试BM25索引...")
+    
+    try:
+        import tempfile
+        from langchain.schema import Document
+        from core.retriever import HybridRetriever
+        
+        docs = [
+            Document(page_content="深蹲是力量举三大项之一，主要锻炼下肢力量。", metadata={'file_name': 'a.txt'}),
+            Document(page_content="卧推主要锻炼胸部和上肢力量。", metadata={'file_name': 'b.txt'}),
+            Document(page_content="硬拉起始时保持背部挺直。", metadata={'file_name': 'c.txt'}),
+        ]
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            retriever = HybridRetriever(vector_store=None, index_dir=Path(tmp))
+            retriever.setup_bm25_retriever(docs[:2])
+            retriever.add_bm25_documents(docs[2:])
+            
+            # 新实例从磁盘加载完整语料的索引
+            reloaded = HybridRetriever(vector_store=None, index_dir=Path(tmp))
+            assert len(reloaded._bm25.corpus) == 3, len(reloaded._bm25.corpus)
+            
+            hits = reloaded.keyword_search("卧推怎么练", n_results=1)
+            assert hits and hits[0]['metadata']['file_name'] == 'b.txt', hits
+            hits = reloaded.keyword_search("硬拉", n_results=1)
+            assert hits and hits[0]['metadata']['file_name'] == 'c.txt', hits
+        
+        print("  ✅ BM25索引: 增量合并、保存与加载正常")
+        return True
+        
+    except Exception as e:
+        print(f"  ❌ BM25索引测试失败: {e!r}")
+        return False
+
+def test_embedding_cache():
+    """测试向量磁盘缓存读写"""
+    print("🧪 测试向量缓存...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        from knowledge.embedding_cache import EmbeddingCache
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = EmbeddingCache(Path(tmp) / "cache.sqlite")
+            vectors = np.random.default_rng(0).standard_normal((3, 8)).astype(np.float32)
+            cache.put_many("model", ["a", "b", "c"], vectors)
+            
+            got = cache.get_many("model", ["b", "missing", "a"])
+            assert got[1] is None
+            assert got[0].dtype == np.float32 and got[0].shape == (8,)
+            # 以float16存储，允许半精度误差
+            assert np.allclose(got[0], vectors[1], atol=1e-2) and np.allclose(got[2], vectors[0], atol=1e-2)
+            # 不同模型名的键互不命中
+            assert cache.get_many("other-model", ["a"]) == [None]
+            cache.close()
+        
+        print("  ✅ 向量缓存: 写入与读取一致")
+        return True
+        
+    except Exception as e:
+        print(f"  ❌ 向量缓存测试失败: {e!r}")
+        return False
+
+def test_topk_kernel():
+    """测试Numba top-k内核与NumPy参考实现一致"""
+    print("🧪 测试top-k内核...")
+    
+    try:
+        import importlib.util
+        if importlib.util.find_spec("numba") is None:
+            print("  ⚠️ 未安装numba，跳过")
+            return True
+        
+        import numpy as np
+        from knowledge._kernels import topk_cosine
+        
+        rng = np.random.default_rng(0)
+        docs = rng.standard_normal((5000, 64)).astype(np.float32)
+        docs /= np.linalg.norm(docs, axis=1, keepdims=True)
+        query = docs[123] + 0.1 * rng.standard_normal(64).astype(np.float32)
+        query /= np.linalg.norm(query)
+        
+        for k in (1, 10, 100):
+            indices, scores = topk_cosine(docs, query, k)
+            expected = np.argsort(-(docs @ query))[:k]
+            assert np.array_equal(indices, expected), k
+            assert np.allclose(scores, (docs @ query)[expected], atol=1e-5), k
+        
+        print("  ✅ top-k内核: 与NumPy结果一致")
+        return True
+        
+    except Exception as e:
+        print(f"  ❌ top-k内核测试失败: {e!r}")
+        return False
+
+def test_stream_batching():
+    """测试流式输出按时间窗口合并片段"""
+    print("🧪 测试流式片段合并...")
+    
+    try:
+        from ui.chat_interface import _batch_chunks
+        
+        chunks = [f"片段{i}" for i in range(50)]
+        
+        # 窗口很长：只在结束时输出一次
+        batches = list(_batch_chunks(iter(chunks), interval=60))
+        assert batches == ["".join(chunks)], batches
+        
+        # 窗口为负（总是超时）：每个片段单独输出
+        batches = list(_batch_chunks(iter(chunks), interval=-1))
+        assert batches == chunks, batches
+        
+        # 空输入不输出任何内容
+        assert list(_batch_chunks(iter([]))) == []
+        
+        print("  ✅ 流式片段合并: 内容完整，按窗口输出")
+        return True
+        
+    except Exception as e:
+        print(f"  ❌ 流式片段合并测试失败: {e!r}")
+        return False
+
 def main():
     """主测试函数"""
     print("🏋️ BarbellGPT - 离线功能测试")
@@ -95,6 +247,11 @@ def main():
         ("基础模块", test_basic_modules),
         ("向量存储", test_vector_store),
         ("简单对话", test_simple_conversation),
+        ("RRF融合", test_rrf_merge),
+        ("BM25索引", test_bm25_persistence),
+        ("向量缓存", test_embedding_cache),
+        ("top-k内核", test_topk_kernel),
+        ("流式片段合并", test_stream_batching),
     ]
     
     passed = 0
@@ -1,71 +1,193 @@
 import streamlit as st
+import threading
+import time
 import uuid
+from typing import Optional, TYPE_CHECKING
 from loguru import logger
+from langchain_core.messages import HumanMessage, AIMessage
+
+# 代理模块会间接导入向量模型、向量数据库等重量级依赖，延迟到使用时再导入，页面框架可先渲染
+if TYPE_CHECKING:
+    from agents.rag_agent import RAGAgent
+    from agents.conversation_manager import ConversationManager
+
+# 流式输出时两次重绘之间的最小间隔（秒），避免每个token都重绘一次
+STREAM_FLUSH_INTERVAL = 0.05
+# 默认直接渲染的最近消息条数，更早的消息折叠到展开框中
+MESSAGE_WINDOW = 30
+# 每个会话在内存中保留的最大消息条数
+MAX_MESSAGES = 100
+# 传给代理的历史消息条数
+HISTORY_LIMIT = 10
+
+GREETING = "您好，我是 BarbellGPT 💪 力量举训练助手，有什么可以帮您？"
+NEW_SESSION_GREETING = "您好，新会话已开启，请输入问题 💬"
+_GREETINGS = frozenset((GREETING, NEW_SESSION_GREETING))
+
+# 分隔线、标题与正文合并为单个元素，减少每次重跑输出的元素数
+HELP_MD = """
+---
+### ❓ 使用帮助
+
+**如何使用：**
+1. 在底部输入框输入你的问题
+2. 系统自动检索知识库并生成回复
+
+**支持内容：**
+- 力量举训练技巧
+- 动作规范与纠错
+- 周期计划设计
+- 恢复策略与疲劳管理
+"""
+
+FOOTER_HTML = """
+<hr>
+<div style='text-align: center; color: #888;'>
+    🏋️ Powered by LangGraph + Streamlit
+</div>
+"""
 
-from agents.rag_agent import RAGAgent
-from agents.conversation_manager import ConversationManager
+
+# ------------------------
+# 共享资源（进程内所有会话共用）
+# ------------------------
+@st.cache_resource(show_spinner=False)
+def _start_agent_init() -> dict:
+    # 在后台线程中创建代理，页面无需等待模型和客户端加载即可先渲染
+    holder = {"agent": None, "error": None}
+
+    def worker():
+        try:
+            from agents.rag_agent import RAGAgent
+
+            holder["agent"] = RAGAgent()
+            logger.info("RAG代理初始化完成")
+        except Exception as e:
+            holder["error"] = e
+            logger.error(f"RAG 初始化失败: {e}")
+
+    threading.Thread(target=worker, name="rag-agent-init", daemon=True).start()
+    return holder
+
+
+def get_rag_agent() -> Optional["RAGAgent"]:
+    """返回共享的RAG代理，后台初始化尚未完成时返回None"""
+    return _start_agent_init()["agent"]
+
+
+@st.cache_resource(show_spinner=False)
+def get_conversation_manager() -> "ConversationManager":
+    from agents.conversation_manager import ConversationManager
+
+    # 各用户的对话历史按session_id隔离
+    return ConversationManager()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_agent_info(_agent: "RAGAgent") -> dict:
+    # 参数以下划线开头，Streamlit不对代理对象做哈希
+    return _agent.get_agent_info()
 
 
 # ------------------------
-# 状态初始化（含首次 rerun）
+# 状态初始化
 # ------------------------
-def init_state():
-    rerun_needed = False
+@st.fragment(run_every=0.5)
+def _wait_for_agent():
+    # 只轮询本fragment，初始化结束后整页重跑一次
+    holder = _start_agent_init()
+    if holder["agent"] is not None or holder["error"] is not None:
+        st.rerun(scope="app")
+    st.info("正在初始化智能助手，请稍候...")
+
 
+def init_state():
     if "session_id" not in st.session_state:
-        st.session_state.session_id = str(uuid.uuid4())
+        st.session_state.session_id = uuid.uuid4().hex
 
     if "messages" not in st.session_state:
-        # ✅ 加入欢迎语
-        st.session_state.messages = [{
-            "role": "assistant",
-            "content": "您好，我是 BarbellGPT 💪 力量举训练助手，有什么可以帮您？"
-        }]
-        rerun_needed = True  # ✅ 插入后需刷新一次界面
-
-    if "agent_initialized" not in st.session_state:
-        st.session_state.agent_initialized = False
+        # ✅ 加入欢迎语（聊天记录在本函数之后渲染，首次运行即可显示，无需额外rerun）
+        st.session_state.messages = [{"role": "assistant", "content": GREETING}]
 
-    if "rag_agent" not in st.session_state or "conversation_manager" not in st.session_state:
-        try:
-            with st.spinner("正在初始化智能助手..."):
-                st.session_state.rag_agent = RAGAgent()
-                st.session_state.conversation_manager = ConversationManager()
-                st.session_state.agent_initialized = True
-                logger.info("RAG代理初始化完成")
-        except Exception as e:
-            st.error(f"初始化失败: {e}")
-            logger.error(f"RAG 初始化失败: {e}")
-
-    # ✅ 强制刷新，确保欢迎语立刻显示
-    if rerun_needed:
-        st.rerun()
+    # 每次运行都按后台初始化的实际状态刷新，重新初始化后所有会话同步生效
+    holder = _start_agent_init()
+    st.session_state.agent_initialized = holder["agent"] is not None
+    if holder["error"] is not None:
+        st.error(f"初始化失败: {holder['error']}")
+    elif not st.session_state.agent_initialized:
+        _wait_for_agent()
 
 
 # ------------------------
 # 聊天输入处理
 # ------------------------
-def process_user_input(user_input: str):
+def _trim_messages():
+    # 只保留最近的消息，避免会话状态随对话长度无限增长
+    if len(st.session_state.messages) > MAX_MESSAGES:
+        st.session_state.messages = st.session_state.messages[-MAX_MESSAGES:]
+
+
+def _recent_history(limit: int = HISTORY_LIMIT):
+    # 直接取会话状态中当前问题之前的最近消息，不再回读对话管理器；
+    # 欢迎语和错误提示不是真实对话内容，不传给模型
+    return [
+        HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+        for m in st.session_state.messages[-(limit + 1):-1]
+        if m.get("content") and not m.get("error") and m["content"] not in _GREETINGS
+    ]
+
+
+def _batch_chunks(chunks, interval: float = STREAM_FLUSH_INTERVAL):
+    # 按时间分桶合并片段：距上次输出超过interval才产出一次，结束时产出剩余内容
+    buf: list[str] = []
+    last_flush = time.monotonic()
+    for chunk in chunks:
+        buf.append(chunk)
+        now = time.monotonic()
+        if now - last_flush > interval:
+            yield "".join(buf)
+            buf.clear()
+            last_flush = now
+    if buf:
+        yield "".join(buf)
+
+
+def process_user_input_stream(user_input: str):
     st.session_state.messages.append({"role": "user", "content": user_input})
-    cm = st.session_state.conversation_manager
-    cm.add_message(st.session_state.session_id, user_input, is_user=True)
+    with st.chat_message("user"):
+        st.markdown(user_input)
+
+    cm = get_conversation_manager()
+    session_id = st.session_state.session_id
+
+    failed = False
+    with st.chat_message("assistant"):
+        try:
+            history = _recent_history()
+            cm.add_message(session_id, user_input, is_user=True)
+
+            # 交给Streamlit原生的流式渲染，片段先按时间窗口合并以减少增量更新次数
+            full_response = st.write_stream(
+                _batch_chunks(get_rag_agent().chat_stream(user_input, history))
+            )
 
-    history = cm.get_conversation_history(st.session_state.session_id, limit=10)
-    try:
-        response = st.session_state.rag_agent.chat(user_input, history)
-        cm.add_message(st.session_state.session_id, response, is_user=False)
-        st.session_state.messages.append({"role": "assistant", "content": response})
-    except Exception as e:
-        err_msg = f"❌ 处理失败: {e}"
-        logger.error(err_msg)
-        st.session_state.messages.append({"role": "assistant", "content": err_msg})
+            cm.add_message(session_id, full_response, is_user=False)
+        except Exception as e:
+            full_response = f"❌ 处理失败: {e}"
+            failed = True
+            logger.error(full_response)
+            st.markdown(full_response)
+
+    # 错误提示只用于显示，标记后不作为对话历史传给模型
+    st.session_state.messages.append({"role": "assistant", "content": full_response, "error": failed})
+    _trim_messages()
 
 
 # ------------------------
 # 渲染聊天记录
 # ------------------------
-def render_messages():
-    for msg in st.session_state.messages:
+def _render_message_list(messages):
+    for msg in messages:
         role = msg.get("role")
         content = msg.get("content")
         if role in ("user", "assistant") and content:
@@ -73,6 +195,29 @@ def render_messages():
                 st.markdown(content)
 
 
+@st.fragment
+def _older_messages_view(older_msgs):
+    # 以fragment运行：展开较早消息时只重跑这一部分，不重新渲染最近消息和流式回复；
+    # fragment重跑时沿用首次调用的参数，显示内容与页面其余部分保持一致
+    if st.session_state.get("show_older_messages"):
+        with st.expander(f"较早的 {len(older_msgs)} 条消息", expanded=True):
+            _render_message_list(older_msgs)
+    elif st.button(f"显示较早的 {len(older_msgs)} 条消息"):
+        st.session_state.show_older_messages = True
+        st.rerun(scope="fragment")
+
+
+def render_messages():
+    msgs = st.session_state.messages
+    older = len(msgs) - MESSAGE_WINDOW
+
+    # 长对话只渲染最近的消息，较早的消息在用户展开时才渲染
+    if older > 0:
+        _older_messages_view(msgs[:older])
+
+    _render_message_list(msgs[-MESSAGE_WINDOW:])
+
+
 # ------------------------
 # 主面板（仅聊天记录）
 # ------------------------
@@ -83,58 +228,50 @@ def render_main_panel():
 # ------------------------
 # 侧边栏
 # ------------------------
+@st.fragment
 def render_sidebar():
-    with st.sidebar:
-        st.header("📊 系统信息")
+    # 以fragment运行：侧边栏内的交互只重跑本函数；调用方负责放入st.sidebar
+    st.header("📊 系统信息")
 
-        if st.session_state.agent_initialized:
-            rag_agent = st.session_state.rag_agent
-            try:
-                info = rag_agent.get_agent_info()
-                st.subheader("🤖 代理信息")
-                st.write(f"类型: {info.get('agent_type', '未知')}")
-                st.write(f"文档数: {info.get('vector_store_info', {}).get('document_count', 0)}")
-                st.write(f"模型: {info.get('llm_info', {}).get('model_name', '未知')}")
-                st.write(f"状态: {'✅ 已连接' if info.get('llm_info', {}).get('is_initialized', False) else '❌ 未连接'}")
-            except Exception as e:
-                st.error("获取代理信息失败")
-                logger.error(f"获取代理信息失败: {e}")
-
-        st.subheader("💬 对话管理")
-        if st.button("🗑 清空对话"):
-            st.session_state.messages = [{
-                "role": "assistant",
-                "content": "您好，我是 BarbellGPT 💪 力量举训练助手，有什么可以帮您？"
-            }]
-            st.session_state.conversation_manager.clear_conversation(st.session_state.session_id)
-            st.rerun()
-
-        if st.button("🆕 新对话"):
-            st.session_state.session_id = str(uuid.uuid4())
-            st.session_state.messages = [{
-                "role": "assistant",
-                "content": "您好，新会话已开启，请输入问题 💬"
-            }]
-            st.rerun()
-
-        if st.button("🔄 重新初始化"):
-            for key in ["rag_agent", "conversation_manager", "agent_initialized"]:
-                st.session_state.pop(key, None)
-            st.rerun()
-
-        st.markdown("---")
-        st.subheader("❓ 使用帮助")
-        st.markdown("""
-        **如何使用：**
-        1. 在底部输入框输入你的问题
-        2. 系统自动检索知识库并生成回复
-
-        **支持内容：**
-        - 力量举训练技巧
-        - 动作规范与纠错
-        - 周期计划设计
-        - 恢复策略与疲劳管理
-        """)
+    if st.session_state.agent_initialized:
+        rag_agent = get_rag_agent()
+        try:
+            info = _cached_agent_info(rag_agent)
+            st.subheader("🤖 代理信息")
+            st.write(f"类型: {info.get('agent_type', '未知')}")
+            st.write(f"文档数: {info.get('vector_store_info', {}).get('document_count', 0)}")
+            st.write(f"模型: {info.get('llm_info', {}).get('model_name', '未知')}")
+            st.write(f"状态: {'✅ 已连接' if info.get('llm_info', {}).get('is_initialized', False) else '❌ 未连接'}")
+        except Exception as e:
+            st.error("获取代理信息失败")
+            logger.error(f"获取代理信息失败: {e}")
+
+    st.subheader("💬 对话管理")
+    if st.button("🗑 清空对话"):
+        st.session_state.messages = [{"role": "assistant", "content": GREETING}]
+        get_conversation_manager().clear_conversation(st.session_state.session_id)
+        st.session_state.pop("show_older_messages", None)
+        st.rerun(scope="app")
+
+    if st.button("🆕 新对话"):
+        st.session_state.session_id = uuid.uuid4().hex
+        st.session_state.messages = [{"role": "assistant", "content": NEW_SESSION_GREETING}]
+        st.session_state.pop("show_older_messages", None)
+        st.rerun(scope="app")
+
+    if st.button("🔄 重新初始化"):
+        # 代理和对话管理器由所有会话共用，这里只重置当前会话的状态；
+        # 仅当共享代理初始化失败时才重新发起初始化（此时没有其他会话在使用它）
+        get_conversation_manager().clear_conversation(st.session_state.session_id)
+        st.session_state.session_id = uuid.uuid4().hex
+        st.session_state.messages = [{"role": "assistant", "content": GREETING}]
+        st.session_state.pop("show_older_messages", None)
+        if _start_agent_init()["error"] is not None:
+            _start_agent_init.clear()
+        _cached_agent_info.clear()
+        st.rerun(scope="app")
+
+    st.markdown(HELP_MD)
 
 
 # ------------------------
@@ -153,26 +290,22 @@ def main():
     st.title("🏋️ BarbellGPT - 力量举训练智能助手")
     st.markdown("---")
 
-    col1, col2 = st.columns([3, 1])
+    col1, _ = st.columns([3, 1])
     with col1:
         render_main_panel()
-    with col2:
+    # fragment不能写入自身之外的容器，因此在外层进入侧边栏
+    with st.sidebar:
         render_sidebar()
 
-    st.markdown("---")
-    st.markdown("""
-    <div style='text-align: center; color: #888;'>
-        🏋️ Powered by LangGraph + Streamlit
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(FOOTER_HTML, unsafe_allow_html=True)
 
-    # ✅ 仅此一处输入框，固定底部
+    # ✅ 仅此一处输入框，固定底部；新一轮对话以流式方式追加在聊天记录之后
     if prompt := st.chat_input("请输入你的问题..."):
         if st.session_state.agent_initialized:
-            process_user_input(prompt)
+            with col1:
+                process_user_input_stream(prompt)
         else:
             st.warning("系统未就绪，请稍候...")
-    render_messages()
 
 
 # ------------------------